@@ -1,7 +1,8 @@
 from cancer_rag.ai.prompts import knowledge_prompt, conversation_prompt, grade_prompt
-from cancer_rag.utils import RExtract
+from cancer_rag.utils import RExtract, VectorizedRunnable
 from cancer_rag.ai.models import KnowledgeBase, GradeDocuments
 from cancer_rag.ai.llms import OllamaLLMProvider, AwsLLMProvider
+from cancer_rag.ai.context_budget import ContextAssembler, get_token_budget_config
 
 from langchain.evaluation.scoring import ScoreStringEvalChain
 
@@ -19,6 +20,8 @@ LLM_PROVIDER_MAP = {
 LLM_PROVIDER = LLM_PROVIDER_MAP.get(envs.get('LLM_PROVIDER', 'OLLAMA'), None)
 assert LLM_PROVIDER is not None, f"Available LLM_PROVIDER are {LLM_PROVIDER_MAP.key()}"
 llm_provider = LLM_PROVIDER()
+# Prompt assemblers of the chains with a token_budget, by llm_config key
+context_assemblers = {}
 
 
 @chain
@@ -40,6 +43,26 @@ def extract_know_base(x):
     x['know_base'] = know_base
     return x 
 
+def pair_with_retrieval(ret_chain):
+    # Pairs each state with its retrieval results, batches go through the vectorized retriever
+    return VectorizedRunnable(
+        lambda x: (x, ret_chain.invoke(x)),
+        lambda xs: list(zip(xs, ret_chain.batch(xs))),
+        name="pair_with_retrieval"
+    )
+
+def with_token_budget(prompt, chain_config, key):
+    # Prompt inputs are fitted to the chain's token_budget before formatting when one is configured
+    budget_config = get_token_budget_config(chain_config)
+    if budget_config is None:
+        return prompt
+    assembler = ContextAssembler(prompt, budget_config, name=key)
+    context_assemblers[key] = assembler
+    return assembler.as_runnable() | prompt
+
+def prompt_token_stats():
+    return {key : assembler.stats() for key, assembler in context_assemblers.items()}
+
 def create_knowledge_chain(llm_config, ret_chain, key='knowledge_chain'):
     print("Initializing Knowledge Chain")
     llm = llm_provider.load_llm(llm_config[key])
@@ -50,7 +73,7 @@ def create_knowledge_chain(llm_config, ret_chain, key='knowledge_chain'):
         extract_know_base 
         | info_update
         | RunnableAssign({"query" : extract_query})
-        | (lambda x: (x, ret_chain.invoke(x)))
+        | pair_with_retrieval(ret_chain)
         | merge_outputs
     )
     return knowledge_chain.with_retry()
@@ -58,7 +81,7 @@ def create_knowledge_chain(llm_config, ret_chain, key='knowledge_chain'):
 def create_conversion_chain(llm_config, key='conversation_chain'):
     print("Initializing Conversational Chain")
     llm = llm_provider.load_llm(llm_config[key])
-    external_chain = conversation_prompt | llm
+    external_chain = with_token_budget(conversation_prompt, llm_config[key], key) | llm
     return extract_know_base | external_chain.with_retry()
 
 def create_grader_chain(llm_config, key='grader_chain'):
@@ -66,7 +89,7 @@ def create_grader_chain(llm_config, key='grader_chain'):
     # LLM with function call
     grader_llm = llm_provider.load_llm(llm_config[key], chat_model=True)
     context_grader = (
-                        grade_prompt 
+                        with_token_budget(grade_prompt, llm_config[key], key)
                         | grader_llm.with_structured_output(GradeDocuments) 
                         | RunnableLambda(lambda x : x.relevancy_score)
                     )
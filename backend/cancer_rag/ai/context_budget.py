@@ -0,0 +1,172 @@
+import re
+import math
+import threading
+
+from langchain_core.runnables.base import RunnableLambda
+
+from cancer_rag.utils import SENTENCE_BOUNDARY
+
+TOKEN_BUDGET_DEFAULTS = {
+    "max_prompt_tokens" : 3072,
+    "tokenizer" : None,
+    "chars_per_token" : 4,
+    "section_max_tokens" : {},
+    "min_snippet_tokens" : 32,
+}
+# Retrieved snippets are "Q: ...\nA: ..." joined by newlines, in score order
+SNIPPET_START = re.compile(r'\n(?=Q: )')
+ANSWER_START = "\nA: "
+WORD_BOUNDARY = re.compile(r'\s+')
+
+
+def get_token_budget_config(chain_config):
+    budget_config = chain_config.get('token_budget')
+    if budget_config is None:
+        return None
+    budget_config = {**TOKEN_BUDGET_DEFAULTS, **budget_config}
+    budget_config['section_max_tokens'] = budget_config['section_max_tokens'] or {}
+    return budget_config
+
+
+class TokenCounter:
+    """
+    Counts tokens with the target model's HF tokenizer, or estimates them as characters / chars_per_token
+    when no tokenizer is configured
+    """
+    def __init__(self, tokenizer_name=None, chars_per_token=4):
+        self.tokenizer_name = tokenizer_name
+        self.chars_per_token = chars_per_token
+        self.tokenizer = None
+        if tokenizer_name:
+            # transformers ships with sentence-transformers, only needed when a tokenizer is configured
+            from transformers import AutoTokenizer
+            self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+            print(f"Prompt token counter using {tokenizer_name} tokenizer")
+
+    def count(self, text):
+        if not text:
+            return 0
+        if self.tokenizer is None:
+            return math.ceil(len(text) / self.chars_per_token)
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+
+def truncate_to_tokens(text, max_tokens, counter, start=0):
+    """
+    Longest prefix of text within max_tokens that ends at a sentence boundary, or at a word boundary when
+    no sentence fits (preprocessed corpus text has no punctuation). Cuts are only made after start.
+    Returns None when nothing past start fits
+    """
+    if counter.count(text) <= max_tokens:
+        return text
+    for boundary in [SENTENCE_BOUNDARY, WORD_BOUNDARY]:
+        cuts = [match.start() for match in boundary.finditer(text) if match.start() > start]
+        # Prefix token counts grow with the cut, so the longest fitting cut is found by bisection
+        low, high, best = 0, len(cuts) - 1, None
+        while low <= high:
+            middle = (low + high) // 2
+            if counter.count(text[:cuts[middle]]) <= max_tokens:
+                best, low = cuts[middle], middle + 1
+            else:
+                high = middle - 1
+        if best is not None:
+            return text[:best].rstrip()
+    return None
+
+
+class ContextAssembler:
+    """
+    Fits a prompt's inputs into max_prompt_tokens. Sections listed in section_max_tokens (know_base, summary,
+    output...) are cut to their cap, then context gets what is left of the budget. Retrieved snippets are
+    added whole in score order, the first one that does not fit is cut at a sentence boundary when at least
+    min_snippet_tokens of it fit, and the rest are dropped. Every call reports the tokens used per section.
+    """
+    def __init__(self, prompt, budget_config, name="prompt"):
+        self.name = name
+        self.max_prompt_tokens = budget_config['max_prompt_tokens']
+        self.section_max_tokens = budget_config['section_max_tokens']
+        self.min_snippet_tokens = budget_config['min_snippet_tokens']
+        self.counter = TokenCounter(budget_config['tokenizer'], budget_config['chars_per_token'])
+        self.variables = list(prompt.input_variables)
+        # Instruction text of the template itself, rendered once with every variable empty
+        template_messages = prompt.format_messages(**{variable : "" for variable in self.variables})
+        self.template_tokens = sum(self.counter.count(message.content) for message in template_messages)
+        self.lock = threading.Lock()
+        self.totals = {"prompts" : 0, "tokens" : 0, "max_tokens" : 0, "over_budget" : 0, "snippets_dropped" : 0, "snippets_truncated" : 0}
+
+    def fit_context(self, context, max_tokens):
+        # Returns the fitted context and (snippets kept, dropped, truncated)
+        snippets = [snippet for snippet in SNIPPET_START.split(context or "") if snippet]
+        kept, used, truncated = [], 0, 0
+        for snippet in snippets:
+            # The newline joining it to the previous snippet counts towards the budget
+            snippet_tokens = self.counter.count(snippet if not kept else "\n" + snippet)
+            if used + snippet_tokens <= max_tokens:
+                kept.append(snippet)
+                used += snippet_tokens
+                continue
+            remaining = max_tokens - used
+            if remaining >= self.min_snippet_tokens:
+                # Keep the question line, the cut falls inside the answer
+                answer_start = snippet.find(ANSWER_START)
+                cut = truncate_to_tokens(snippet, remaining - (1 if kept else 0), self.counter, answer_start + len(ANSWER_START) if answer_start >= 0 else 0)
+                if cut is not None:
+                    kept.append(cut)
+                    truncated = 1
+            break
+        return "\n".join(kept), (len(kept), len(snippets) - len(kept), truncated)
+
+    def assemble(self, state):
+        """Copy of the prompt inputs within budget, with the per-section token report"""
+        state = dict(state)
+        report = {"template" : self.template_tokens}
+        for variable in self.variables:
+            if variable == "context":
+                continue
+            text = str(state.get(variable, ""))
+            cap = self.section_max_tokens.get(variable)
+            tokens = self.counter.count(text)
+            if cap is not None and tokens > cap:
+                text = truncate_to_tokens(text, cap, self.counter) or ""
+                state[variable] = text
+                tokens = self.counter.count(text)
+            report[variable] = tokens
+
+        if "context" in self.variables:
+            context_budget = max(0, self.max_prompt_tokens - sum(report.values()))
+            cap = self.section_max_tokens.get("context")
+            if cap is not None:
+                context_budget = min(context_budget, cap)
+            state['context'], (kept, dropped, truncated) = self.fit_context(state.get('context', ""), context_budget)
+            report['context'] = self.counter.count(state['context'])
+            report['snippets'] = {"kept" : kept, "dropped" : dropped, "truncated" : truncated}
+
+        total = sum(tokens for section, tokens in report.items() if section != "snippets")
+        report['total'] = total
+        report['budget'] = self.max_prompt_tokens
+        self.record(report)
+        print(f"Prompt tokens ({self.name}): {report}")
+        return state
+
+    def record(self, report):
+        with self.lock:
+            self.totals['prompts'] += 1
+            self.totals['tokens'] += report['total']
+            self.totals['max_tokens'] = max(self.totals['max_tokens'], report['total'])
+            self.totals['over_budget'] += int(report['total'] > self.max_prompt_tokens)
+            snippets = report.get('snippets', {})
+            self.totals['snippets_dropped'] += snippets.get('dropped', 0)
+            self.totals['snippets_truncated'] += snippets.get('truncated', 0)
+
+    def stats(self):
+        with self.lock:
+            prompts = self.totals['prompts']
+            return {
+                "budget" : self.max_prompt_tokens,
+                "tokenizer" : self.counter.tokenizer_name or f"heuristic ({self.counter.chars_per_token} chars/token)",
+                **self.totals,
+                "mean_tokens" : round(self.totals['tokens'] / prompts, 1) if prompts else 0.0,
+            }
+
+    def as_runnable(self):
+        return RunnableLambda(self.assemble, name=f"assemble_{self.name}")
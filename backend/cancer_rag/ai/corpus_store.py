@@ -0,0 +1,166 @@
+import os
+import numpy as np
+import pandas as pd
+
+
+def is_arrow_column(column):
+    # ArrowDtype columns (parquet / Arrow IPC datasources) and pyarrow backed pandas strings
+    return isinstance(column.dtype, pd.ArrowDtype) or getattr(column.dtype, 'storage', None) == "pyarrow"
+
+
+def arrow_strings(column):
+    """The Arrow string array behind a pandas column, None when it is not a null free Arrow string column"""
+    if not is_arrow_column(column) or column.hasnans:
+        return None
+    import pyarrow as pa
+    array = pa.array(column.array)
+    if isinstance(array, pa.ChunkedArray):
+        # A single chunk is used as is, several are concatenated
+        array = array.chunk(0) if array.num_chunks == 1 else array.combine_chunks()
+    if not (pa.types.is_string(array.type) or pa.types.is_large_string(array.type)):
+        return None
+    return array
+
+
+class StringColumn:
+    """
+    Column of strings stored as one contiguous UTF-8 buffer plus an offsets array.
+    Row i is data[offsets[i]:offsets[i+1]], decoded only when it is accessed.
+    """
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return bytes(self.data[start:end]).decode('utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @classmethod
+    def from_arrow(cls, array):
+        """
+        Column over an Arrow string array without copying, its UTF-8 data and offsets buffers are used
+        as they are (pages of the file when the array comes from a memory mapped Arrow IPC file)
+        """
+        import pyarrow as pa
+        _, offsets_buffer, data_buffer = array.buffers()
+        offset_type = np.int64 if pa.types.is_large_string(array.type) else np.int32
+        offsets = np.frombuffer(offsets_buffer, dtype=offset_type)[array.offset:array.offset + len(array) + 1]
+        data = np.frombuffer(data_buffer, dtype=np.uint8) if data_buffer is not None else np.zeros(0, dtype=np.uint8)
+        return cls(data, offsets)
+
+    @classmethod
+    def from_series(cls, column):
+        array = arrow_strings(column)
+        return cls.from_arrow(array) if array is not None else cls.from_texts(column.tolist())
+
+    def iter_bytes(self):
+        # Undecoded UTF-8 of every row
+        offsets = np.asarray(self.offsets).tolist()
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            yield self.data[start:end]
+
+    @classmethod
+    def from_texts(cls, texts):
+        encoded = [str(text).encode('utf-8') for text in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return cls(data, offsets)
+
+    def extend(self, texts):
+        """New column with texts appended, the current one is left untouched for in-flight readers"""
+        added = StringColumn.from_texts(texts)
+        data = np.concatenate([np.asarray(self.data), added.data])
+        offsets = np.concatenate([np.asarray(self.offsets), self.offsets[-1] + added.offsets[1:]])
+        return StringColumn(data, offsets)
+
+    def save(self, path_prefix):
+        np.save(f"{path_prefix}.data.npy", self.data)
+        np.save(f"{path_prefix}.offsets.npy", self.offsets)
+
+    @classmethod
+    def load(cls, path_prefix, mmap=False):
+        # With mmap the pages are shared read-only with every process mapping the same file
+        mmap_mode = 'r' if mmap else None
+        data = np.load(f"{path_prefix}.data.npy", mmap_mode=mmap_mode)
+        offsets = np.load(f"{path_prefix}.offsets.npy", mmap_mode=mmap_mode)
+        return cls(data, offsets)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.offsets.nbytes
+
+
+def format_snippet(question, answer):
+    return f"Q: {question}\nA: {answer}"
+
+
+class CorpusStore:
+    """
+    Question and Answer text columns indexed by corpus position (the FAISS id).
+    snippets optionally holds each row's context text formatted at build time.
+    """
+    def __init__(self, questions, answers, snippets=None):
+        assert len(questions) == len(answers), "Question and Answer columns must have the same length"
+        self.questions = questions
+        self.answers = answers
+        self.snippets = snippets
+
+    def __len__(self):
+        return len(self.questions)
+
+    def question(self, i):
+        return self.questions[i]
+
+    def answer(self, i):
+        return self.answers[i]
+
+    def snippet(self, i):
+        if self.snippets is not None:
+            return self.snippets[i]
+        return format_snippet(self.questions[i], self.answers[i])
+
+    @classmethod
+    def from_df(cls, data, snippets=False):
+        # Arrow backed columns are wrapped without copying, other columns are encoded into a new buffer
+        return cls(
+            StringColumn.from_series(data['Question']),
+            StringColumn.from_series(data['Answer']),
+            StringColumn.from_texts(map(format_snippet, data['Question'].tolist(), data['Answer'].tolist())) if snippets else None
+        )
+
+    def extend(self, data):
+        """Corpus with the rows of data appended after the current positions"""
+        questions, answers = data['Question'].tolist(), data['Answer'].tolist()
+        return CorpusStore(
+            self.questions.extend(questions),
+            self.answers.extend(answers),
+            self.snippets.extend(map(format_snippet, questions, answers)) if self.snippets is not None else None
+        )
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.questions.save(os.path.join(directory, 'questions'))
+        self.answers.save(os.path.join(directory, 'answers'))
+        if self.snippets is not None:
+            self.snippets.save(os.path.join(directory, 'snippets'))
+
+    @classmethod
+    def load(cls, directory, mmap=False):
+        snippets_prefix = os.path.join(directory, 'snippets')
+        return cls(
+            StringColumn.load(os.path.join(directory, 'questions'), mmap=mmap),
+            StringColumn.load(os.path.join(directory, 'answers'), mmap=mmap),
+            StringColumn.load(snippets_prefix, mmap=mmap) if os.path.exists(f"{snippets_prefix}.data.npy") else None
+        )
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in [self.questions, self.answers, self.snippets] if column is not None)
@@ -0,0 +1,95 @@
+import zlib
+
+import faiss
+import numpy as np
+
+from cancer_rag.ai.lexical import tokenize
+
+DEDUP_DEFAULTS = {"cosine_threshold" : 0.95, "jaccard_threshold" : 0.8, "num_perm" : 128, "seed" : 7}
+# Mersenne prime for the MinHash permutations (a * x + b) mod p
+MINHASH_PRIME = (1 << 61) - 1
+
+
+def get_dedup_config(index_config):
+    dedup_config = (index_config or {}).get('dedup')
+    if dedup_config is None:
+        return None
+    return {**DEDUP_DEFAULTS, **dedup_config}
+
+
+def minhash_signatures(texts, num_perm=128, seed=7):
+    """(num_texts, num_perm) MinHash signatures over the token sets of preprocessed texts"""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, MINHASH_PRIME, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, MINHASH_PRIME, size=num_perm, dtype=np.uint64)
+    signatures = np.full((len(texts), num_perm), np.iinfo(np.uint64).max, dtype=np.uint64)
+    for row, text in enumerate(texts):
+        tokens = np.array(sorted({zlib.crc32(token.encode('utf-8')) for token in tokenize(text)}), dtype=np.uint64)
+        if len(tokens) == 0:
+            continue
+        # uint64 products wrap, which keeps them a fixed pseudo-random permutation of the token hashes
+        signatures[row] = ((tokens[:, None] * a + b) % MINHASH_PRIME).min(axis=0)
+    return signatures
+
+
+def similar_pairs(vectors, threshold):
+    """Index pairs (i < j) whose cosine similarity is at least threshold"""
+    unit_vectors = np.ascontiguousarray(vectors, dtype=np.float32).copy()
+    faiss.normalize_L2(unit_vectors)
+    index = faiss.IndexFlatIP(unit_vectors.shape[1])
+    index.add(unit_vectors)
+    lims, _, neighbours = index.range_search(unit_vectors, threshold)
+    rows = np.repeat(np.arange(len(unit_vectors)), np.diff(lims).astype(np.int64))
+    keep = rows < neighbours
+    return set(zip(rows[keep].tolist(), neighbours[keep].tolist()))
+
+
+def find_root(parents, i):
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]
+        i = parents[i]
+    return i
+
+
+def find_duplicate_groups(corpus_data, question_vectors, answer_vectors, dedup_config):
+    """
+    Group near-duplicate rows. Pairs whose questions or answers are embedding neighbours are confirmed
+    by MinHash Jaccard over the question + answer tokens, so paraphrased questions with different answers
+    stay apart. Returns the canonical row of every row
+    """
+    candidates = similar_pairs(question_vectors, dedup_config['cosine_threshold'])
+    candidates |= similar_pairs(answer_vectors, dedup_config['cosine_threshold'])
+    texts = (corpus_data['Question'].astype(str) + " " + corpus_data['Answer'].astype(str)).tolist()
+    signatures = minhash_signatures(texts, dedup_config['num_perm'], dedup_config['seed'])
+
+    parents = np.arange(len(corpus_data))
+    for i, j in candidates:
+        if np.mean(signatures[i] == signatures[j]) >= dedup_config['jaccard_threshold']:
+            parents[find_root(parents, i)] = find_root(parents, j)
+    roots = np.array([find_root(parents, i) for i in range(len(parents))])
+
+    # The member with the longest answer carries the most information, earliest row on ties
+    answer_lengths = corpus_data['Answer'].astype(str).str.len().to_numpy()
+    order = np.lexsort((np.arange(len(roots)), -answer_lengths, roots))
+    canonical = {}
+    for row in order:
+        canonical.setdefault(roots[row], row)
+    return np.array([canonical[root] for root in roots], dtype=np.int64)
+
+
+def collapse_duplicates(corpus_data, question_vectors, answer_vectors, dedup_config):
+    """
+    Keep one canonical row per near-duplicate group.
+    Returns the reduced corpus and vectors plus (alias ids, canonical ids) arrays for the dropped rows
+    """
+    canonical_rows = find_duplicate_groups(corpus_data, question_vectors, answer_vectors, dedup_config)
+    keep = canonical_rows == np.arange(len(canonical_rows))
+    ids = np.asarray(corpus_data.index, dtype=np.int64)
+    alias_ids, canonical_ids = ids[~keep], ids[canonical_rows[~keep]]
+
+    num_rows, num_kept = len(keep), int(keep.sum())
+    print(
+        f"Near-duplicate collapse: {num_rows} -> {num_kept} rows, {num_rows - num_kept} aliases in "
+        f"{len(np.unique(canonical_ids))} groups ({100 * (num_rows - num_kept) / max(num_rows, 1):.1f}% smaller index)"
+    )
+    return corpus_data[keep], question_vectors[keep], answer_vectors[keep], alias_ids, canonical_ids
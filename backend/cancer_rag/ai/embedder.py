@@ -0,0 +1,343 @@
+import os
+import json
+import time
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from cancer_rag.utils import preprocess_text
+
+EMBEDDING_CACHE_DEFAULTS = {"max_size" : 4096, "ttl_seconds" : None}
+EMBEDDING_BATCHING_DEFAULTS = {"max_batch_size" : 16, "max_wait_ms" : 5}
+# Upper edges of the batch size and queue depth histogram buckets, the last bucket is open ended
+HISTOGRAM_EDGES = [0, 1, 2, 4, 8, 16, 32, 64]
+ONNX_DEFAULTS = {"quantize" : False, "num_threads" : None, "batch_size" : 32}
+
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_INT8_MODEL_FILE = "model_int8.onnx"
+ONNX_CONFIG_FILE = "embedder.json"
+
+
+def embedder_identity(embedder_config):
+    # Vectors are only interchangeable between identical backend, model and encode settings
+    embedder_params = embedder_config['params']
+    identity = [embedder_config['backend'], embedder_params['model_name'], embedder_params.get('encode_kwargs', {})]
+    if embedder_params.get('quantize'):
+        identity.append("int8")
+    return json.dumps(identity, sort_keys=True)
+
+
+def export_onnx_embedder(model_name, output_dir, quantize=True, opset=17):
+    """
+    Export a sentence-transformers model to ONNX with its pooling and normalization layers in the graph,
+    so the ONNX output is the sentence embedding HF returns. Writes model.onnx, optionally a dynamic int8
+    model_int8.onnx, the tokenizer and embedder.json into output_dir
+    """
+    # Export only dependencies, serving needs onnxruntime and the tokenizer
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device='cpu')
+    model.eval()
+    tokenizer = model.tokenizer
+    input_names = [name for name in tokenizer.model_input_names if name in ("input_ids", "attention_mask", "token_type_ids")]
+
+    class SentenceEmbedding(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(dict(zip(input_names, inputs)))['sentence_embedding']
+
+    os.makedirs(output_dir, exist_ok=True)
+    sample = tokenizer(["export sample"], padding=True, return_tensors="pt")
+    dynamic_axes = {name : {0 : "batch", 1 : "sequence"} for name in input_names}
+    dynamic_axes["sentence_embedding"] = {0 : "batch"}
+    with torch.no_grad():
+        torch.onnx.export(
+            SentenceEmbedding(model), tuple(sample[name] for name in input_names),
+            os.path.join(output_dir, ONNX_MODEL_FILE), input_names=input_names,
+            output_names=["sentence_embedding"], dynamic_axes=dynamic_axes, opset_version=opset
+        )
+    tokenizer.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, ONNX_CONFIG_FILE), "w") as f:
+        json.dump({"model_name" : model_name, "max_length" : model.max_seq_length, "input_names" : input_names}, f, indent=2)
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        # Weights to int8, activations quantized per batch at run time
+        quantize_dynamic(
+            os.path.join(output_dir, ONNX_MODEL_FILE), os.path.join(output_dir, ONNX_INT8_MODEL_FILE),
+            weight_type=QuantType.QInt8
+        )
+    print(f"ONNX embedder for {model_name} exported to {output_dir}")
+    return output_dir
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    Sentence embeddings from a model exported by export_onnx_embedder, run with ONNX Runtime on CPU.
+    Texts are tokenized and run in length sorted batches so padding stays short.
+    """
+    def __init__(self, onnx_dir, quantize=False, num_threads=None, batch_size=32, normalize_embeddings=False):
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        model_file = ONNX_INT8_MODEL_FILE if quantize else ONNX_MODEL_FILE
+        model_path = os.path.join(onnx_dir, model_file)
+        assert os.path.exists(model_path), f"{model_path} not found, export it with scripts/export_onnx_embedder.py"
+        with open(os.path.join(onnx_dir, ONNX_CONFIG_FILE)) as f:
+            onnx_config = json.load(f)
+
+        session_options = onnxruntime.SessionOptions()
+        session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            session_options.intra_op_num_threads = num_threads
+            session_options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(model_path, session_options, providers=["CPUExecutionProvider"])
+        self.tokenizer = AutoTokenizer.from_pretrained(onnx_dir)
+        self.input_names = onnx_config['input_names']
+        self.max_length = onnx_config['max_length']
+        self.batch_size = batch_size
+        self.normalize_embeddings = normalize_embeddings
+
+    def embed(self, texts):
+        if len(texts) == 0:
+            return np.zeros((0, 0), dtype=np.float32)
+        order = np.argsort([len(text) for text in texts], kind='stable')
+        batches = []
+        for start in range(0, len(texts), self.batch_size):
+            batch_texts = [texts[i] for i in order[start:start + self.batch_size]]
+            encoded = self.tokenizer(batch_texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="np")
+            inputs = {name : encoded[name].astype(np.int64) for name in self.input_names}
+            batches.append(self.session.run(None, inputs)[0])
+        vectors = np.empty((len(texts), batches[0].shape[1]), dtype=np.float32)
+        vectors[order] = np.concatenate(batches)
+        if self.normalize_embeddings:
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed(list(texts)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed([text])[0].tolist()
+
+
+def init_onnx_embedder(embedder_params):
+    onnx_params = {**ONNX_DEFAULTS, **embedder_params}
+    embedder = OnnxEmbeddings(
+        onnx_params['onnx_dir'],
+        quantize=onnx_params['quantize'],
+        num_threads=onnx_params['num_threads'],
+        batch_size=onnx_params['batch_size'],
+        normalize_embeddings=onnx_params.get('encode_kwargs', {}).get('normalize_embeddings', False)
+    )
+    precision = "int8" if onnx_params['quantize'] else "fp32"
+    print(f"ONNX Embedder Initialized with {embedder_params['model_name']} ({precision}, {onnx_params['num_threads'] or 'default'} threads)")
+    return embedder
+
+
+def embedding_parity(reference, candidate, questions, answers, k=3):
+    """
+    Compare two embedders on a corpus: cosine between their vectors of the same answer text and the
+    agreement of the top k answers retrieved for each question (fraction of shared hits, exact top 1 rate)
+    """
+    def unit(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    reference_answers, candidate_answers = unit(reference.embed_documents(answers)), unit(candidate.embed_documents(answers))
+    reference_questions, candidate_questions = unit(reference.embed_documents(questions)), unit(candidate.embed_documents(questions))
+    cosines = np.sum(reference_answers * candidate_answers, axis=1)
+
+    k = min(k, len(answers))
+    reference_top = np.argsort(-(reference_questions @ reference_answers.T), axis=1, kind='stable')[:, :k]
+    candidate_top = np.argsort(-(candidate_questions @ candidate_answers.T), axis=1, kind='stable')[:, :k]
+    overlap = [len(set(ref) & set(cand)) / k for ref, cand in zip(reference_top, candidate_top)]
+    return {
+        "num_texts" : len(answers),
+        "min_cosine" : float(cosines.min()),
+        "mean_cosine" : float(cosines.mean()),
+        f"top{k}_overlap" : float(np.mean(overlap)),
+        "top1_agreement" : float(np.mean(reference_top[:, 0] == candidate_top[:, 0])),
+    }
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    LRU cache of query embeddings in front of an embedder, keyed on preprocess_text output and the
+    embedder identity. Entries older than ttl_seconds are recomputed. Document embeddings (index builds
+    and syncs) pass straight through so they do not evict live queries.
+    """
+    def __init__(self, embedder, identity, max_size=4096, ttl_seconds=None):
+        self.embedder = embedder
+        self.identity = identity
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.cache = OrderedDict()
+        # langserve runs requests on a thread pool, every cache access holds the lock
+        self.lock = threading.Lock()
+        self.counters = {"hits" : 0, "misses" : 0, "evictions" : 0, "expirations" : 0}
+
+    def key(self, text):
+        return (self.identity, preprocess_text(text))
+
+    def lookup(self, key):
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+            vector, created = entry
+            if self.ttl_seconds is not None and time.monotonic() - created > self.ttl_seconds:
+                del self.cache[key]
+                self.counters['expirations'] += 1
+                self.counters['misses'] += 1
+                return None
+            self.cache.move_to_end(key)
+            self.counters['hits'] += 1
+            return vector
+
+    def store(self, key, vector):
+        with self.lock:
+            self.cache[key] = (np.asarray(vector, dtype=np.float32), time.monotonic())
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Query embeddings for texts, the uncached ones go through the embedder in one call"""
+        keys = [self.key(text) for text in texts]
+        vectors = [self.lookup(key) for key in keys]
+        # Repeated texts within one batch are embedded once
+        missing = list(dict.fromkeys(key for key, vector in zip(keys, vectors) if vector is None))
+        new_vectors = {}
+        if missing:
+            new_vectors = dict(zip(missing, embed_queries(self.embedder, [key[1] for key in missing])))
+        for key in missing:
+            self.store(key, new_vectors[key])
+        return [
+            (vector if vector is not None else np.asarray(new_vectors[key], dtype=np.float32)).tolist()
+            for key, vector in zip(keys, vectors)
+        ]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embedder.embed_documents(texts)
+
+    def stats(self):
+        with self.lock:
+            return {"identity" : self.identity, "size" : len(self.cache), "max_size" : self.max_size, **self.counters}
+
+
+def histogram_bucket(value):
+    for edge in HISTOGRAM_EDGES:
+        if value <= edge:
+            return str(edge)
+    return f">{HISTOGRAM_EDGES[-1]}"
+
+
+class BatchingEmbeddings(Embeddings):
+    """
+    Micro-batches query embeddings across concurrent requests. Callers queue their texts and wait on
+    one future each, a worker thread runs everything queued as one forward pass once max_batch_size
+    texts are waiting or max_wait_ms after the first. Document embeddings pass straight through.
+    """
+    def __init__(self, embedder, max_batch_size=16, max_wait_ms=5):
+        self.embedder = embedder
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_ms / 1000
+        self.queue = queue.Queue()
+        self.worker = None
+        self.worker_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.counters = {"batches" : 0, "texts" : 0, "max_queue_depth" : 0}
+        self.batch_sizes = {}
+        self.queue_depths = {}
+
+    def submit(self, text):
+        # The worker starts on first use, so it is created in the serving process and not before a fork
+        if self.worker is None:
+            with self.worker_lock:
+                if self.worker is None:
+                    self.worker = threading.Thread(target=self.run, name="embedding-batcher", daemon=True)
+                    self.worker.start()
+        future = Future()
+        self.queue.put((text, future))
+        return future
+
+    def next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait_seconds
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            self.record(len(batch), self.queue.qsize())
+            texts = [text for text, _ in batch]
+            try:
+                vectors = embed_queries(self.embedder, texts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+    def record(self, batch_size, queue_depth):
+        # queue_depth counts the texts still waiting after this batch was taken
+        with self.stats_lock:
+            self.counters['batches'] += 1
+            self.counters['texts'] += batch_size
+            self.counters['max_queue_depth'] = max(self.counters['max_queue_depth'], queue_depth)
+            size_bucket, depth_bucket = histogram_bucket(batch_size), histogram_bucket(queue_depth)
+            self.batch_sizes[size_bucket] = self.batch_sizes.get(size_bucket, 0) + 1
+            self.queue_depths[depth_bucket] = self.queue_depths.get(depth_bucket, 0) + 1
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        futures = [self.submit(text) for text in texts]
+        return [future.result() for future in futures]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.submit(text).result()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embedder.embed_documents(texts)
+
+    def stats(self):
+        with self.stats_lock:
+            return {
+                "max_batch_size" : self.max_batch_size,
+                "max_wait_ms" : self.max_wait_seconds * 1000,
+                "queue_depth" : self.queue.qsize(),
+                **self.counters,
+                "mean_batch_size" : round(self.counters['texts'] / max(self.counters['batches'], 1), 2),
+                "batch_size_histogram" : dict(self.batch_sizes),
+                "queue_depth_histogram" : dict(self.queue_depths),
+            }
+
+
+def embed_queries(embedder, texts):
+    """Query vectors for a batch, a single query uses embed_query and a batch one padded forward pass"""
+    if isinstance(embedder, (CachedEmbeddings, BatchingEmbeddings)):
+        return embedder.embed_queries(texts)
+    if len(texts) == 1:
+        return [embedder.embed_query(texts[0])]
+    return embedder.embed_documents(texts)
@@ -0,0 +1,274 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+
+import faiss
+import numpy as np
+
+from cancer_rag.ai.corpus_store import CorpusStore, StringColumn, arrow_strings
+from cancer_rag.ai.embedder import embedder_identity
+from cancer_rag.ai.lexical import BM25Index
+from cancer_rag.ai.passages import PassageStore
+from cancer_rag.ai.indexes import get_build_params
+
+# Bump whenever the on-disk layout changes so stale artifacts get rebuilt
+ARTIFACT_VERSION = 8
+
+META_FILE = "meta.json"
+QUESTION_INDEX_FILE = "questions.index"
+ANSWER_INDEX_FILE = "answers.index"
+IDS_FILE = "ids.npy"
+# (alias id, canonical id) rows of near-duplicates collapsed at build time
+ALIASES_FILE = "aliases.npy"
+CORPUS_DIR = "corpus"
+PARTITIONS_DIR = "partitions"
+POSITIONS_FILE = "positions.npy"
+# Passage positions of a partition's answer sub-index, when answers are split into passages
+ANSWER_POSITIONS_FILE = "answer_positions.npy"
+PASSAGES_DIR = "passages"
+LEXICAL_DIR = "lexical"
+# Build provenance and per-file sha256, makes an artifact a self-describing deployable bundle
+MANIFEST_FILE = "manifest.json"
+CHECKSUM_CHUNK_BYTES = 1 << 20
+# Artifacts kept in an index cache dir, the least recently used beyond this are deleted after a build
+INDEX_CACHE_KEEP = 4
+
+# Map index codes straight from the file so all workers share one read-only copy.
+# IVF inverted lists only support the plain IO_FLAG_MMAP reader
+MMAP_READ_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+IVF_MMAP_READ_FLAGS = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+
+
+def compute_index_hash(corpus_data, embedder_config, index_config=None):
+    """Content hash of the corpus, the embedder settings and the index build parameters"""
+    hasher = hashlib.sha256()
+    hasher.update(f"artifact-v{ARTIFACT_VERSION}".encode())
+    hasher.update(embedder_identity(embedder_config).encode())
+    hasher.update(json.dumps(get_build_params(index_config), sort_keys=True).encode())
+    hasher.update(np.asarray(corpus_data.index, dtype=np.int64).tobytes())
+    for column in ['Question', 'Answer']:
+        array = arrow_strings(corpus_data[column])
+        # Arrow columns are hashed straight from their buffers, the same bytes str.encode would give
+        texts = StringColumn.from_arrow(array).iter_bytes() if array is not None else (text.encode('utf-8') for text in corpus_data[column].astype(str))
+        for text in texts:
+            hasher.update(text)
+            hasher.update(b'\x1f')
+    return hasher.hexdigest()
+
+
+def artifact_path(cache_dir, index_hash):
+    return os.path.join(cache_dir, index_hash)
+
+
+def file_checksums(directory):
+    """sha256 of every file under directory keyed by relative path, the manifest itself excluded"""
+    checksums = {}
+    for root, _, files in os.walk(directory):
+        for file_name in sorted(files):
+            path = os.path.join(root, file_name)
+            relative_path = os.path.relpath(path, directory)
+            if relative_path == MANIFEST_FILE:
+                continue
+            hasher = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(CHECKSUM_CHUNK_BYTES), b""):
+                    hasher.update(chunk)
+            checksums[relative_path] = hasher.hexdigest()
+    return dict(sorted(checksums.items()))
+
+
+def save_index_artifact(target_dir, index_hash, artifact, embedder_config, index_config=None, source=None):
+    """
+    Write both FAISS indexes, the id mapping, the corpus, answer passages, partition sub-indexes and the
+    BM25 index of an artifact dict under target_dir, with a manifest of the build settings and file checksums
+    """
+    parent_dir = os.path.dirname(os.path.abspath(target_dir))
+    os.makedirs(parent_dir, exist_ok=True)
+    if os.path.exists(os.path.join(target_dir, META_FILE)):
+        return target_dir
+
+    question_index, ids = artifact['question_index'], artifact['ids']
+    partitions, lexical_index = artifact.get('partitions') or {}, artifact.get('lexical_index')
+    aliases, passage_store = artifact.get('aliases'), artifact.get('passage_store')
+    # Write into a temp dir first so a crashed or concurrent build never leaves a half artifact
+    tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=parent_dir)
+    try:
+        faiss.write_index(question_index, os.path.join(tmp_dir, QUESTION_INDEX_FILE))
+        faiss.write_index(artifact['answer_index'], os.path.join(tmp_dir, ANSWER_INDEX_FILE))
+        np.save(os.path.join(tmp_dir, IDS_FILE), np.asarray(ids, dtype=np.int64))
+        aliases = np.zeros((0, 2), dtype=np.int64) if aliases is None else np.asarray(aliases, dtype=np.int64)
+        np.save(os.path.join(tmp_dir, ALIASES_FILE), aliases)
+        # Corpus rows are in FAISS position order
+        artifact['corpus_store'].save(os.path.join(tmp_dir, CORPUS_DIR))
+        for name, partition in partitions.items():
+            partition_dir = os.path.join(tmp_dir, PARTITIONS_DIR, name)
+            os.makedirs(partition_dir)
+            faiss.write_index(partition['question_index'], os.path.join(partition_dir, QUESTION_INDEX_FILE))
+            faiss.write_index(partition['answer_index'], os.path.join(partition_dir, ANSWER_INDEX_FILE))
+            np.save(os.path.join(partition_dir, POSITIONS_FILE), partition['positions'])
+            if 'answer_positions' in partition:
+                np.save(os.path.join(partition_dir, ANSWER_POSITIONS_FILE), partition['answer_positions'])
+        if passage_store is not None:
+            passage_store.save(os.path.join(tmp_dir, PASSAGES_DIR))
+        if lexical_index is not None:
+            lexical_index.save(os.path.join(tmp_dir, LEXICAL_DIR))
+
+        meta = {
+            "version": ARTIFACT_VERSION,
+            "index_hash": index_hash,
+            "embedder_backend": embedder_config['backend'],
+            "model_name": embedder_config['params']['model_name'],
+            "encode_kwargs": embedder_config['params'].get('encode_kwargs', {}),
+            "quantize": bool(embedder_config['params'].get('quantize', False)),
+            "num_documents": int(len(ids)),
+            "num_aliases": int(len(aliases)),
+            "dimension": int(question_index.d),
+            "index_type": type(question_index).__name__,
+            "partitions": sorted(partitions),
+            "lexical": lexical_index is not None,
+            "num_passages": None if passage_store is None else int(len(passage_store)),
+        }
+        with open(os.path.join(tmp_dir, META_FILE), "w") as f:
+            json.dump(meta, f, indent=2)
+
+        manifest = {
+            "version": ARTIFACT_VERSION,
+            "index_hash": index_hash,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "source": source,
+            # The query cache is a serving setting, only the settings that produced the vectors are recorded
+            "embedder_config": {"backend" : embedder_config['backend'], "params" : embedder_config['params']},
+            "index_config": index_config or {},
+            "build_params": get_build_params(index_config),
+            "files": file_checksums(tmp_dir),
+        }
+        with open(os.path.join(tmp_dir, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+        os.replace(tmp_dir, target_dir)
+        print(f"Index artifact saved at {target_dir}")
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        # Only a rename that lost the race to another worker publishing the same artifact is expected,
+        # anything else (disk full, permissions) is the caller's to handle
+        if not os.path.exists(os.path.join(target_dir, META_FILE)):
+            raise
+    return target_dir
+
+
+def read_index(path, mmap=False):
+    if not mmap:
+        return faiss.read_index(path)
+    try:
+        return faiss.read_index(path, MMAP_READ_FLAGS)
+    except RuntimeError:
+        return faiss.read_index(path, IVF_MMAP_READ_FLAGS)
+
+
+def read_manifest(target_dir):
+    manifest_path = os.path.join(target_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def verify_bundle(target_dir):
+    """Relative paths of the files whose checksum differs from the manifest, missing or unexpected files included"""
+    manifest = read_manifest(target_dir)
+    assert manifest is not None, f"No {MANIFEST_FILE} in {target_dir}"
+    checksums = file_checksums(target_dir)
+    expected = manifest['files']
+    return sorted(path for path in set(expected) | set(checksums) if expected.get(path) != checksums.get(path))
+
+
+def load_artifact_dir(target_dir, mmap=False):
+    """
+    Load the artifact stored in target_dir.
+    With mmap the index vectors and corpus text are mapped read-only instead of copied into the process.
+    """
+    with open(os.path.join(target_dir, META_FILE)) as f:
+        meta = json.load(f)
+    ids = np.load(os.path.join(target_dir, IDS_FILE), mmap_mode='r' if mmap else None)
+    corpus_store = CorpusStore.load(os.path.join(target_dir, CORPUS_DIR), mmap=mmap)
+    artifact = {
+        "meta": meta,
+        "manifest": read_manifest(target_dir),
+        "question_index": read_index(os.path.join(target_dir, QUESTION_INDEX_FILE), mmap=mmap),
+        "answer_index": read_index(os.path.join(target_dir, ANSWER_INDEX_FILE), mmap=mmap),
+        "ids": ids,
+        "aliases": np.load(os.path.join(target_dir, ALIASES_FILE)),
+        "corpus_store": corpus_store,
+        "partitions": {},
+        "lexical_index": BM25Index.load(os.path.join(target_dir, LEXICAL_DIR), mmap=mmap) if meta.get("lexical") else None,
+        "passage_store": PassageStore.load(os.path.join(target_dir, PASSAGES_DIR), mmap=mmap) if meta.get("num_passages") is not None else None,
+    }
+    for name in meta.get("partitions", []):
+        partition_dir = os.path.join(target_dir, PARTITIONS_DIR, name)
+        artifact["partitions"][name] = {
+            "positions": np.load(os.path.join(partition_dir, POSITIONS_FILE), mmap_mode='r' if mmap else None),
+            "question_index": read_index(os.path.join(partition_dir, QUESTION_INDEX_FILE), mmap=mmap),
+            "answer_index": read_index(os.path.join(partition_dir, ANSWER_INDEX_FILE), mmap=mmap),
+        }
+        answer_positions_path = os.path.join(partition_dir, ANSWER_POSITIONS_FILE)
+        if os.path.exists(answer_positions_path):
+            artifact["partitions"][name]["answer_positions"] = np.load(answer_positions_path, mmap_mode='r' if mmap else None)
+    print(f"Index artifact loaded from {target_dir} ({meta['num_documents']} documents, mmap={mmap})")
+    return artifact
+
+
+def load_index_artifact(cache_dir, index_hash, mmap=False):
+    """Return the cached artifact for index_hash, or None when it is missing or stale"""
+    target_dir = artifact_path(cache_dir, index_hash)
+    meta_path = os.path.join(target_dir, META_FILE)
+    if not os.path.exists(meta_path):
+        print(f"No index artifact found for {index_hash[:12]}")
+        return None
+
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if meta.get("version") != ARTIFACT_VERSION or meta.get("index_hash") != index_hash:
+        print(f"Index artifact at {target_dir} is stale")
+        return None
+    try:
+        # Marks the artifact as recently used for prune_index_cache
+        os.utime(target_dir)
+    except OSError:
+        pass
+    return load_artifact_dir(target_dir, mmap=mmap)
+
+
+def prune_index_cache(cache_dir, keep, current_hash):
+    """
+    Delete all but the keep most recently built or loaded artifacts in cache_dir, never the one of current_hash.
+    Workers still mapping a deleted artifact keep reading it until they exit
+    """
+    artifacts = []
+    for name in os.listdir(cache_dir):
+        path = artifact_path(cache_dir, name)
+        # Temp dirs of in-flight builds start with a dot
+        if name == current_hash or name.startswith(".") or not os.path.exists(os.path.join(path, META_FILE)):
+            continue
+        try:
+            artifacts.append((os.path.getmtime(path), path))
+        except OSError:
+            # Pruned by another worker
+            continue
+    for _, path in sorted(artifacts, reverse=True)[max(keep - 1, 0):]:
+        shutil.rmtree(path, ignore_errors=True)
+        print(f"Pruned index artifact {path}")
+
+
+def load_bundle(bundle_dir, mmap=False, verify=True):
+    """Load a prebuilt bundle written by scripts/build_index.py, checking its layout version and checksums"""
+    manifest = read_manifest(bundle_dir)
+    assert manifest is not None, f"{bundle_dir} is not an index bundle, {MANIFEST_FILE} is missing"
+    assert manifest.get("version") == ARTIFACT_VERSION, \
+        f"Bundle {bundle_dir} has layout version {manifest.get('version')}, this backend reads {ARTIFACT_VERSION}. Rebuild it"
+    if verify:
+        mismatched = verify_bundle(bundle_dir)
+        assert not mismatched, f"Bundle {bundle_dir} failed checksum verification: {mismatched}"
+    return load_artifact_dir(bundle_dir, mmap=mmap)
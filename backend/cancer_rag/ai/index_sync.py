@@ -0,0 +1,61 @@
+import threading
+from contextlib import contextmanager
+
+
+class ReadWriteLock:
+    """Many concurrent readers or one writer. Writers wait for in-flight reads and block new ones"""
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class IndexSyncWorker(threading.Thread):
+    """Background thread calling sync_fn every interval_seconds until stopped"""
+    def __init__(self, sync_fn, interval_seconds):
+        super().__init__(name="index-sync", daemon=True)
+        self.sync_fn = sync_fn
+        self.interval_seconds = interval_seconds
+        self._stop_event = threading.Event()
+
+    def run(self):
+        print(f"Index sync started, running every {self.interval_seconds}s")
+        while not self._stop_event.wait(self.interval_seconds):
+            try:
+                self.sync_fn()
+            except Exception as e:
+                # Keep serving from the current index and retry on the next tick
+                print(f"Index sync failed: {e}")
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,141 @@
+import math
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ["flat", "hnsw", "ivf_flat", "ivf_pq"]
+# l2 keeps raw embeddings. cosine stores unit vectors in an inner product index so the search result is the score
+METRICS = ["l2", "cosine"]
+# Scalar quantizer used for stored vectors, ivf_pq is already compressed and only supports float32
+STORAGE_TYPES = {"float32" : None, "float16" : "SQfp16", "int8" : "SQ8"}
+
+# Defaults for every tunable. Build params change the stored index, search params are applied at load time
+BUILD_PARAM_DEFAULTS = {
+    "flat" : {},
+    "hnsw" : {"M" : 32, "ef_construction" : 40},
+    "ivf_flat" : {"nlist" : 1024},
+    "ivf_pq" : {"nlist" : 1024, "pq_m" : 64, "pq_nbits" : 8},
+}
+SEARCH_PARAM_DEFAULTS = {
+    "flat" : {},
+    "hnsw" : {"ef_search" : 64},
+    "ivf_flat" : {"nprobe" : 16},
+    "ivf_pq" : {"nprobe" : 16},
+}
+
+# faiss recommends at least this many training points per IVF list
+MIN_POINTS_PER_LIST = 39
+
+
+def get_index_type(index_config):
+    index_type = (index_config or {}).get('type', 'flat')
+    assert index_type in INDEX_TYPES, f"index type {index_type} not supported. Supported: {INDEX_TYPES}"
+    return index_type
+
+
+def get_metric(index_config):
+    metric = (index_config or {}).get('metric', 'l2')
+    assert metric in METRICS, f"index metric {metric} not supported. Supported: {METRICS}"
+    return metric
+
+
+def get_build_params(index_config):
+    """Index type and build parameters, the part of index_config that determines the stored index"""
+    index_config = index_config or {}
+    index_type = get_index_type(index_config)
+    storage = index_config.get('storage', 'float32')
+    assert storage in STORAGE_TYPES, f"index storage {storage} not supported. Supported: {list(STORAGE_TYPES)}"
+    assert index_type != "ivf_pq" or storage == "float32", "ivf_pq stores PQ codes, storage must be float32"
+    params = {key : index_config.get(key, default) for key, default in BUILD_PARAM_DEFAULTS[index_type].items()}
+    if index_config.get('partitions'):
+        # Partition assignment decides which sub-indexes get stored
+        params['partitions'] = index_config['partitions']
+    if index_config.get('dedup') is not None:
+        # Collapsed duplicates are left out of the stored index
+        params['dedup'] = index_config['dedup']
+    if index_config.get('snippets'):
+        params['snippets'] = True
+    if index_config.get('passages') is not None:
+        # Answers are embedded as sentence window passages
+        params['passages'] = {key : index_config['passages'].get(key, default) for key, default in [('sentences', 3), ('overlap', 1)]}
+    if index_config.get('lexical') is not None:
+        # BM25 postings are stored with the artifact
+        params['lexical'] = {key : index_config['lexical'].get(key, default) for key, default in [('k1', 1.2), ('b', 0.75)]}
+    return {"type" : index_type, "metric" : get_metric(index_config), "storage" : storage, **params}
+
+
+def prepare_vectors(vectors, index_config):
+    """Normalize vectors in place for the cosine metric, used for both stored and query vectors"""
+    if get_metric(index_config) == "cosine":
+        faiss.normalize_L2(vectors)
+    return vectors
+
+
+def relevance_scores(distances, metric):
+    if metric == "cosine":
+        # Inner product of unit vectors is already the cosine similarity
+        return distances
+    # Same euclidean relevance function as langchain's FAISS store, so L2 thresholds are unchanged
+    return 1.0 - distances / math.sqrt(2)
+
+
+def build_index(vectors, index_config):
+    """Create an empty FAISS index for vectors, trained on them when the index type needs training"""
+    params = get_build_params(index_config)
+    index_type = params['type']
+    num_vectors, dimension = vectors.shape
+    if index_type == "ivf_pq" and num_vectors < 2 ** params['pq_nbits']:
+        # PQ codebooks need 2**pq_nbits training points, a smaller corpus is searched exactly instead
+        print(f"{num_vectors} vectors are too few to train {params['pq_nbits']} bit PQ codebooks, falling back to flat")
+        return build_index(vectors, {**index_config, 'type' : 'flat'})
+    metric = faiss.METRIC_INNER_PRODUCT if params['metric'] == "cosine" else faiss.METRIC_L2
+    quantizer = STORAGE_TYPES[params['storage']]
+
+    if index_type == "flat":
+        description = quantizer or "Flat"
+    elif index_type == "hnsw":
+        description = f"HNSW{params['M']}" + (f"_{quantizer}" if quantizer else "")
+    else:
+        # Small corpora cannot fill the configured number of lists
+        nlist = max(1, min(params['nlist'], num_vectors // MIN_POINTS_PER_LIST))
+        if index_type == "ivf_flat":
+            description = f"IVF{nlist},{quantizer or 'Flat'}"
+        else:
+            assert dimension % params['pq_m'] == 0, f"pq_m {params['pq_m']} must divide embedding size {dimension}"
+            description = f"IVF{nlist},PQ{params['pq_m']}x{params['pq_nbits']}"
+
+    if description == "Flat" and metric == faiss.METRIC_L2:
+        index = faiss.IndexFlatL2(dimension)
+    else:
+        index = faiss.index_factory(dimension, description, metric)
+    if index_type == "hnsw":
+        index.hnsw.efConstruction = params['ef_construction']
+
+    if not index.is_trained:
+        print(f"Training {index_type} index on {num_vectors} vectors")
+        index.train(vectors)
+    print(f"Built {description} index ({params['metric']}) for {num_vectors} vectors")
+    apply_search_params(index, index_config)
+    return index
+
+
+def apply_search_params(index, index_config):
+    """Set query time parameters (efSearch, nprobe) on a built or loaded index"""
+    index_config = index_config or {}
+    index_type = get_index_type(index_config)
+    params = {key : index_config.get(key, default) for key, default in SEARCH_PARAM_DEFAULTS[index_type].items()}
+    if 'ef_search' in params and hasattr(index, 'hnsw'):
+        index.hnsw.efSearch = params['ef_search']
+    if 'nprobe' in params:
+        ivf_index = faiss.try_extract_index_ivf(index)
+        if ivf_index is not None:
+            ivf_index.nprobe = params['nprobe']
+    return index
+
+
+def embed_documents(embedder, documents, index_config=None):
+    if len(documents) == 0:
+        # np.array([]) is 1-d, which FAISS can neither normalize nor add
+        return np.zeros((0, len(embedder.embed_query(""))), dtype=np.float32)
+    vectors = np.array(embedder.embed_documents([doc.page_content for doc in documents]), dtype=np.float32)
+    return prepare_vectors(vectors, index_config)
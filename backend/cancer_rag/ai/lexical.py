@@ -0,0 +1,138 @@
+import os
+import json
+
+import numpy as np
+
+LEXICAL_DEFAULTS = {"k1" : 1.2, "b" : 0.75, "rrf_k" : 60, "min_score" : 0.6, "skip_dense_score" : 0.7, "skip_dense_margin" : 0.15}
+
+# Dropped from documents and queries, they match nearly every row and only add noise
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "how", "i", "if",
+    "in", "is", "it", "its", "me", "my", "of", "on", "or", "should", "that", "the", "their", "there", "this",
+    "to", "was", "what", "when", "where", "which", "who", "why", "will", "with", "you", "your"
+}
+
+VOCAB_FILE = "vocab.json"
+META_FILE = "bm25.json"
+
+
+def get_lexical_config(index_config):
+    lexical_config = (index_config or {}).get('lexical')
+    if lexical_config is None:
+        return None
+    return {**LEXICAL_DEFAULTS, **lexical_config}
+
+
+def get_lexical_build_params(index_config):
+    # Only k1 and b change the stored postings, the rest is tuned at query time
+    lexical_config = get_lexical_config(index_config)
+    return None if lexical_config is None else {"k1" : lexical_config['k1'], "b" : lexical_config['b']}
+
+
+def tokenize(text):
+    """Tokens of preprocess_text output"""
+    return [token for token in text.split() if token not in STOPWORDS]
+
+
+def lexical_texts(corpus_store):
+    # Questions and answers are indexed together, one lexical document per corpus row
+    return [f"{question} {answer}" for question, answer in zip(corpus_store.questions, corpus_store.answers)]
+
+
+class BM25Index:
+    """
+    Okapi BM25 inverted index over corpus positions. Postings are stored CSR style (offsets, docs)
+    with the BM25 weight of each posting precomputed, so a query is a sum over its terms' postings.
+    """
+    def __init__(self, vocab, idf, offsets, docs, weights, k1, b):
+        self.vocab = vocab
+        self.idf = idf
+        self.offsets = offsets
+        self.docs = docs
+        self.weights = weights
+        self.k1 = k1
+        self.b = b
+
+    @classmethod
+    def build(cls, texts, k1=1.2, b=0.75):
+        vocab = {}
+        term_ids, doc_ids, doc_lengths = [], [], np.zeros(len(texts), dtype=np.float32)
+        for position, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths[position] = len(tokens)
+            for token in tokens:
+                term_ids.append(vocab.setdefault(token, len(vocab)))
+                doc_ids.append(position)
+        term_ids = np.array(term_ids, dtype=np.int64)
+        doc_ids = np.array(doc_ids, dtype=np.int64)
+
+        # Term frequency per (term, doc) pair, sorted by term then doc
+        pairs, tfs = np.unique(term_ids * len(texts) + doc_ids, return_counts=True)
+        pair_terms, pair_docs = pairs // max(len(texts), 1), pairs % max(len(texts), 1)
+        doc_freqs = np.bincount(pair_terms, minlength=len(vocab))
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(doc_freqs, out=offsets[1:])
+
+        num_docs = len(texts)
+        idf = np.log(1 + (num_docs - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+        avg_length = max(float(doc_lengths.mean()) if num_docs else 0.0, 1.0)
+        norm = k1 * (1 - b + b * doc_lengths[pair_docs] / avg_length)
+        weights = (idf[pair_terms] * tfs * (k1 + 1) / (tfs + norm)).astype(np.float32)
+        return cls(vocab, idf, offsets, pair_docs.astype(np.int32), weights, k1, b)
+
+    def score(self, text, num_docs):
+        """BM25 scores of every document for one query, normalized by the query's upper bound to 0-1"""
+        term_ids = [self.vocab[token] for token in set(tokenize(text)) if token in self.vocab]
+        scores = np.zeros(num_docs, dtype=np.float32)
+        if not term_ids:
+            return scores
+        for term_id in term_ids:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            scores[self.docs[start:end]] += self.weights[start:end]
+        # A posting weight never exceeds idf * (k1 + 1), so 1 means every term saturated in a short doc
+        return scores / (float(self.idf[term_ids].sum()) * (self.k1 + 1))
+
+    def search(self, texts, k, mask):
+        """
+        Top k lexical hits per query among documents where mask is set.
+        Returns (positions, scores, valid) arrays shaped (num_queries, k) like the dense search
+        """
+        k = min(k, len(mask))
+        positions = np.full((len(texts), k), -1, dtype=np.int64)
+        scores = np.zeros((len(texts), k), dtype=np.float32)
+        for row, text in enumerate(texts):
+            doc_scores = np.where(mask, self.score(text, len(mask)), 0.0)
+            top = np.argpartition(-doc_scores, k - 1)[:k] if k < len(mask) else np.arange(len(mask))
+            top = top[np.argsort(-doc_scores[top], kind='stable')]
+            positions[row], scores[row] = top, doc_scores[top]
+        return positions, scores, scores > 0
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, VOCAB_FILE), "w") as f:
+            json.dump(sorted(self.vocab, key=self.vocab.get), f)
+        with open(os.path.join(directory, META_FILE), "w") as f:
+            json.dump({"k1" : self.k1, "b" : self.b}, f)
+        for name in ["idf", "offsets", "docs", "weights"]:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, directory, mmap=False):
+        with open(os.path.join(directory, VOCAB_FILE)) as f:
+            vocab = {term : term_id for term_id, term in enumerate(json.load(f))}
+        with open(os.path.join(directory, META_FILE)) as f:
+            meta = json.load(f)
+        arrays = {
+            name : np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r' if mmap else None)
+            for name in ["idf", "offsets", "docs", "weights"]
+        }
+        return cls(vocab, k1=meta['k1'], b=meta['b'], **arrays)
+
+
+def reciprocal_rank_fusion(rankings, rrf_k):
+    """Fuse ranked position lists into one ranking by sum of 1 / (rrf_k + rank)"""
+    fused = {}
+    for ranking in rankings:
+        for rank, position in enumerate(ranking):
+            fused[position] = fused.get(position, 0.0) + 1.0 / (rrf_k + rank + 1)
+    return sorted(fused, key=fused.get, reverse=True)
@@ -0,0 +1,101 @@
+import re
+
+import numpy as np
+
+from cancer_rag.ai.indexes import build_index
+
+GENERAL_PARTITION = "general"
+# disease_site values that carry no site, these queries search the whole corpus
+UNKNOWN_SITES = {"", "unknown", "general", "none", "n/a"}
+
+
+def get_partition_config(index_config):
+    return (index_config or {}).get('partitions') or {}
+
+
+def partitions_enabled(index_config):
+    partition_config = get_partition_config(index_config)
+    return bool(partition_config.get('column') or partition_config.get('sites'))
+
+
+def normalize_label(label):
+    # Labels double as artifact directory names
+    return re.sub(r'\W+', '_', str(label).strip().lower()) or GENERAL_PARTITION
+
+
+def site_patterns(partition_config):
+    """One word boundary regex per site, matching the site name or any of its keywords"""
+    patterns = {}
+    for site, keywords in (partition_config.get('sites') or {}).items():
+        terms = [site.replace('_', ' ')] + list(keywords or [])
+        patterns[normalize_label(site)] = re.compile(r"\b(?:" + "|".join(re.escape(term.lower()) for term in terms) + r")")
+    return patterns
+
+
+def assign_partitions(corpus_data, partition_config):
+    """
+    Partition label per corpus row. Uses the configured label column when the corpus has one,
+    otherwise the site whose keywords occur most in the Question text. Rows matching no site are general
+    """
+    column = partition_config.get('column')
+    if column and column in corpus_data.columns:
+        return np.array([normalize_label(label) for label in corpus_data[column].fillna(GENERAL_PARTITION)], dtype=object)
+
+    labels = np.full(len(corpus_data), GENERAL_PARTITION, dtype=object)
+    patterns = site_patterns(partition_config)
+    if not patterns or len(corpus_data) == 0:
+        return labels
+    # Answers mention other sites in passing (skin and liver side effects), so only the question is used
+    texts = corpus_data['Question'].astype(str).str.lower()
+    counts = np.stack([texts.str.count(pattern).to_numpy() for pattern in patterns.values()], axis=1)
+    matched = counts.max(axis=1) > 0
+    labels[matched] = np.array(list(patterns), dtype=object)[counts.argmax(axis=1)][matched]
+    return labels
+
+
+def get_disease_site(query):
+    # know_base is a KnowledgeBase inside the knowledge chain, a plain dict over the context route
+    know_base = query.get('know_base')
+    if isinstance(know_base, dict):
+        return know_base.get('disease_site')
+    if know_base is not None:
+        return getattr(know_base, 'disease_site', None)
+    return query.get('disease_site')
+
+
+def query_partitions(disease_site, partition_config, available):
+    """Partitions to search for a disease_site: the matching sites plus general, or None to search everything"""
+    site = str(disease_site or "").strip().lower()
+    if site in UNKNOWN_SITES:
+        return None
+    matched = {name for name, pattern in site_patterns(partition_config).items() if pattern.search(site)}
+    # Label column partitions are matched on their name
+    matched |= {name for name in available if name != GENERAL_PARTITION and name.replace('_', ' ') in site}
+    matched &= set(available)
+    if not matched:
+        return None
+    return tuple(sorted(matched | ({GENERAL_PARTITION} & set(available))))
+
+
+def build_partition_indexes(question_vectors, answer_vectors, labels, index_config, answer_parents=None):
+    """
+    Sub-indexes per partition label. positions maps each sub-index position back to its corpus position.
+    With answer passages, answer_parents holds the corpus row of each answer vector and answer_positions
+    maps the answer sub-index back to passage positions
+    """
+    partitions = {}
+    answer_labels = labels if answer_parents is None else labels[answer_parents]
+    for label in sorted(set(labels)):
+        positions = np.flatnonzero(labels == label).astype(np.int64)
+        partitions[label] = {"positions" : positions}
+        answer_positions = positions
+        if answer_parents is not None:
+            answer_positions = np.flatnonzero(answer_labels == label).astype(np.int64)
+            partitions[label]["answer_positions"] = answer_positions
+        for level, vectors, level_positions in [("question_index", question_vectors, positions), ("answer_index", answer_vectors, answer_positions)]:
+            sub_vectors = np.ascontiguousarray(vectors[level_positions])
+            index = build_index(sub_vectors, index_config)
+            index.add(sub_vectors)
+            partitions[label][level] = index
+    print(f"Built {len(partitions)} partitions: " + ", ".join(f"{name}={len(p['positions'])}" for name, p in partitions.items()))
+    return partitions
@@ -0,0 +1,102 @@
+import os
+
+import numpy as np
+
+from cancer_rag.ai.corpus_store import StringColumn
+
+PASSAGE_DEFAULTS = {"sentences" : 3, "overlap" : 1}
+PARENTS_FILE = "parents.npy"
+
+
+def get_passage_config(index_config):
+    passage_config = (index_config or {}).get('passages')
+    if passage_config is None:
+        return None
+    passage_config = {**PASSAGE_DEFAULTS, **passage_config}
+    assert 0 <= passage_config['overlap'] < passage_config['sentences'], "passages overlap must be below sentences"
+    return passage_config
+
+
+def passage_parents(corpus_data, answer_documents):
+    # Corpus row of each passage document
+    return corpus_data.index.get_indexer([doc.metadata['id'] for doc in answer_documents]).astype(np.int64)
+
+
+def row_vectors(passage_vectors, parents, num_rows):
+    """Mean of each row's passage vectors, a whole-answer vector for row level steps like dedup"""
+    sums = np.zeros((num_rows, passage_vectors.shape[1]), dtype=np.float32)
+    np.add.at(sums, parents, passage_vectors)
+    return sums / np.maximum(np.bincount(parents, minlength=num_rows), 1)[:, None]
+
+
+def shared_words(left, right):
+    # Longest run of words ending left that also starts right, the sentences two windows share
+    for size in range(min(len(left), len(right)), 0, -1):
+        if left[-size:] == right[:size]:
+            return size
+    return 0
+
+
+def merge_windows(texts, positions, passage_config):
+    """
+    Passages of one row in position order as a single text. Overlapping windows are merged so their shared
+    sentences appear once, windows that do not overlap are joined by " ... "
+    """
+    step = passage_config['sentences'] - passage_config['overlap']
+    pieces, last_position = [], None
+    for position, text in zip(positions, texts):
+        words = text.split()
+        if last_position is not None and (position - last_position) * step < passage_config['sentences']:
+            pieces[-1] = pieces[-1] + words[shared_words(pieces[-1], words):]
+        else:
+            pieces.append(words)
+        last_position = position
+    return " ... ".join(" ".join(words) for words in pieces)
+
+
+class PassageStore:
+    """
+    Sentence window passages of the answers, indexed by answer index position.
+    parents maps every passage to the corpus row it was cut from.
+    """
+    def __init__(self, texts, parents):
+        assert len(texts) == len(parents), "Every passage needs a parent row"
+        self.texts = texts
+        self.parents = parents
+
+    def __len__(self):
+        return len(self.parents)
+
+    def text(self, i):
+        return self.texts[i]
+
+    @classmethod
+    def from_documents(cls, answer_documents, parents):
+        return cls(StringColumn.from_texts(doc.page_content for doc in answer_documents), np.asarray(parents, dtype=np.int64))
+
+    def select(self, row_keep):
+        """Passages of the kept rows, with parents renumbered to the kept row positions. Also returns the passage mask"""
+        passage_keep = row_keep[self.parents]
+        new_rows = np.cumsum(row_keep) - 1
+        texts = [self.texts[i] for i in np.flatnonzero(passage_keep)]
+        return PassageStore(StringColumn.from_texts(texts), new_rows[self.parents[passage_keep]]), passage_keep
+
+    def extend(self, texts, parents):
+        """New store with passages appended, the current one is left untouched for in-flight readers"""
+        return PassageStore(self.texts.extend(texts), np.concatenate([np.asarray(self.parents), np.asarray(parents, dtype=np.int64)]))
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.texts.save(os.path.join(directory, 'texts'))
+        np.save(os.path.join(directory, PARENTS_FILE), np.asarray(self.parents, dtype=np.int64))
+
+    @classmethod
+    def load(cls, directory, mmap=False):
+        return cls(
+            StringColumn.load(os.path.join(directory, 'texts'), mmap=mmap),
+            np.load(os.path.join(directory, PARENTS_FILE), mmap_mode='r' if mmap else None)
+        )
+
+    @property
+    def nbytes(self):
+        return self.texts.nbytes + self.parents.nbytes
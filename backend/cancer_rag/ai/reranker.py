@@ -0,0 +1,124 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.documents import Document
+
+RERANKER_DEFAULTS = {
+    "model_name" : "cross-encoder/ms-marco-MiniLM-L-6-v2",
+    "top_n" : 2,
+    "batch_size" : 32,
+    "max_length" : 512,
+    "budget_ms" : 200,
+    "cache_size" : 10000,
+}
+# Weight of the newest batch in the per-pair latency estimate
+LATENCY_EMA_ALPHA = 0.2
+
+
+def get_reranker_config(retriever_config):
+    reranker_config = retriever_config.get('reranker') or {}
+    if not reranker_config.get('enabled', False):
+        return None
+    return {**RERANKER_DEFAULTS, **reranker_config}
+
+
+def load_cross_encoder(reranker_config):
+    # sentence-transformers ships with the HF embedder backend, only needed when reranking is enabled
+    from sentence_transformers import CrossEncoder
+    model = CrossEncoder(reranker_config['model_name'], device='cpu', max_length=reranker_config['max_length'])
+    print(f"Cross Encoder Initialized with {reranker_config['model_name']}")
+    return model
+
+
+class CrossEncoderReranker:
+    """
+    Rescores retrieved documents against the query with a cross-encoder and keeps the top_n.
+    Pair scores are cached by (query hash, document id). When the uncached pairs of a batch are
+    estimated to take longer than budget_ms, the top_n are kept in retrieval order instead.
+    """
+    def __init__(self, model, reranker_config):
+        self.model = model
+        self.top_n = reranker_config['top_n']
+        self.batch_size = reranker_config['batch_size']
+        self.budget_ms = reranker_config['budget_ms']
+        self.cache_size = reranker_config['cache_size']
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.pair_latency_ms = None
+        self.stats = {"pairs_scored" : 0, "cache_hits" : 0, "skipped" : 0}
+
+    @staticmethod
+    def query_key(query_text):
+        return hashlib.sha1(query_text.encode('utf-8')).hexdigest()
+
+    def cached_score(self, key):
+        with self.lock:
+            if key not in self.cache:
+                return None
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+    def store_scores(self, keys, scores):
+        with self.lock:
+            for key, score in zip(keys, scores):
+                self.cache[key] = float(score)
+                self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def within_budget(self, num_pairs):
+        # Unknown latency runs once to get an estimate
+        with self.lock:
+            pair_latency_ms = self.pair_latency_ms
+        if num_pairs == 0 or pair_latency_ms is None:
+            return True
+        return num_pairs * pair_latency_ms <= self.budget_ms
+
+    def score_pairs(self, pairs):
+        start = time.perf_counter()
+        scores = np.asarray(self.model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False), dtype=np.float32)
+        pair_latency_ms = (time.perf_counter() - start) * 1000 / len(pairs)
+        # The reranker is shared by concurrent requests, the estimate and counters change under the lock
+        with self.lock:
+            if self.pair_latency_ms is None:
+                self.pair_latency_ms = pair_latency_ms
+            else:
+                self.pair_latency_ms += LATENCY_EMA_ALPHA * (pair_latency_ms - self.pair_latency_ms)
+            self.stats['pairs_scored'] += len(pairs)
+        return scores
+
+    def rerank_batch(self, query_texts, documents_list, document_text):
+        """
+        Rerank each query's documents in one cross-encoder batch. document_text maps a document id
+        to the text it is scored on. Returns the top_n documents per query with a rerank_score
+        """
+        keys = [[(self.query_key(query_text), doc.metadata['id']) for doc in documents] for query_text, documents in zip(query_texts, documents_list)]
+        scores = [[self.cached_score(key) for key in row_keys] for row_keys in keys]
+
+        missing = [(row, i) for row, row_scores in enumerate(scores) for i, score in enumerate(row_scores) if score is None]
+        with self.lock:
+            self.stats['cache_hits'] += sum(len(row) for row in scores) - len(missing)
+        if not self.within_budget(len(missing)):
+            print(f"Rerank skipped, {len(missing)} pairs over the {self.budget_ms}ms budget")
+            with self.lock:
+                self.stats['skipped'] += 1
+            return [documents[:self.top_n] for documents in documents_list]
+        if len(missing) > 0:
+            pairs = [(query_texts[row], document_text(documents_list[row][i].metadata['id'])) for row, i in missing]
+            new_scores = self.score_pairs(pairs)
+            for (row, i), score in zip(missing, new_scores):
+                scores[row][i] = float(score)
+            self.store_scores([keys[row][i] for row, i in missing], new_scores)
+
+        results = []
+        for documents, row_scores in zip(documents_list, scores):
+            order = np.argsort(-np.array(row_scores, dtype=np.float32), kind='stable')[:self.top_n]
+            reranked = []
+            for i in order:
+                doc = documents[i]
+                reranked.append(Document(page_content=doc.page_content, metadata={**doc.metadata, "rerank_score" : row_scores[i]}))
+            results.append(reranked)
+        return results
@@ -0,0 +1,103 @@
+import threading
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+
+RESULT_CACHE_DEFAULTS = {"min_similarity" : 0.97, "max_size" : 2048, "neighbours" : 4}
+
+
+def get_result_cache_config(retriever_config):
+    result_cache_config = retriever_config.get('result_cache') or {}
+    if not result_cache_config.get('enabled', False):
+        return None
+    return {**RESULT_CACHE_DEFAULTS, **result_cache_config}
+
+
+class SemanticResultCache:
+    """
+    Formatted retrieval results of recent queries, looked up by query embedding. A query whose cosine
+    similarity to a cached query reaches min_similarity, with the same search scope (partitions),
+    reuses its result. Least recently used entries are evicted beyond max_size and everything is
+    dropped when the corpus version changes.
+    """
+    def __init__(self, dimension, min_similarity=0.97, max_size=2048, neighbours=4):
+        self.min_similarity = min_similarity
+        self.max_size = max_size
+        self.neighbours = neighbours
+        # Exact inner product over unit vectors, small enough that a flat scan is the fast option
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dimension))
+        # entry id -> (scope, result), in LRU order
+        self.entries = OrderedDict()
+        self.next_id = 0
+        self.version = 0
+        self.lock = threading.Lock()
+        self.counters = {"hits" : 0, "misses" : 0, "evictions" : 0, "invalidations" : 0}
+
+    @staticmethod
+    def unit(vectors):
+        vectors = np.array(vectors, dtype=np.float32)
+        faiss.normalize_L2(vectors)
+        return vectors
+
+    def check_version(self, version):
+        """
+        Called with the lock held. A newer corpus version drops every entry. Returns False for a request
+        that read the version before a sync, it neither reads nor writes the cache
+        """
+        if version > self.version:
+            if self.entries:
+                self.counters['invalidations'] += 1
+            self.index.reset()
+            self.entries.clear()
+            self.version = version
+        return version == self.version
+
+    def lookup(self, query_vectors, scopes, version):
+        """Cached result per query, None for a miss"""
+        unit_vectors = self.unit(query_vectors)
+        with self.lock:
+            results = [None] * len(unit_vectors)
+            if self.check_version(version) and self.entries:
+                similarities, entry_ids = self.index.search(unit_vectors, min(self.neighbours, len(self.entries)))
+                for row, scope in enumerate(scopes):
+                    for similarity, entry_id in zip(similarities[row], entry_ids[row]):
+                        if entry_id == -1 or similarity < self.min_similarity:
+                            break
+                        entry_scope, result = self.entries[entry_id]
+                        if entry_scope == scope:
+                            self.entries.move_to_end(entry_id)
+                            results[row] = result
+                            break
+            num_hits = sum(result is not None for result in results)
+            self.counters['hits'] += num_hits
+            self.counters['misses'] += len(results) - num_hits
+            return results
+
+    def store(self, query_vectors, scopes, results, version):
+        """Cache results computed against corpus version, dropped if the corpus changed meanwhile"""
+        unit_vectors = self.unit(query_vectors)
+        with self.lock:
+            if not self.check_version(version):
+                return
+            entry_ids = np.arange(self.next_id, self.next_id + len(unit_vectors), dtype=np.int64)
+            self.next_id += len(unit_vectors)
+            self.index.add_with_ids(unit_vectors, entry_ids)
+            for entry_id, scope, result in zip(entry_ids.tolist(), scopes, results):
+                self.entries[entry_id] = (scope, result)
+            if len(self.entries) > self.max_size:
+                evicted = [self.entries.popitem(last=False)[0] for _ in range(len(self.entries) - self.max_size)]
+                self.index.remove_ids(np.array(evicted, dtype=np.int64))
+                self.counters['evictions'] += len(evicted)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counters['hits'] + self.counters['misses']
+            return {
+                "size" : len(self.entries),
+                "max_size" : self.max_size,
+                "min_similarity" : self.min_similarity,
+                "corpus_version" : self.version,
+                **self.counters,
+                "hit_rate" : round(self.counters['hits'] / lookups, 4) if lookups else 0.0,
+            }
@@ -6,29 +6,74 @@ from langchain_ollama import OllamaEmbeddings
 import pandas as pd
 import numpy as np 
 
-import faiss
-from langchain_community.vectorstores import FAISS
-from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_core.documents import Document
 import torch
 import re
 from typing import List
-from langchain_core.runnables import chain
 import json
 import yaml 
+from concurrent.futures import ThreadPoolExecutor
 
 from cancer_rag.utils import (
     load_data, 
     create_documents_from_df, 
-    preprocess_text
+    preprocess_text,
+    get_worker_memory,
+    VectorizedRunnable,
+    is_db_datasource,
+    load_verified_changes_from_db
 )
+from cancer_rag.ai.corpus_store import CorpusStore, format_snippet
+from cancer_rag.ai.dedup import get_dedup_config, collapse_duplicates
+from cancer_rag.ai.index_store import (
+    artifact_path,
+    compute_index_hash,
+    load_bundle,
+    load_index_artifact,
+    prune_index_cache,
+    save_index_artifact,
+    INDEX_CACHE_KEEP
+)
+from cancer_rag.ai.indexes import (
+    build_index,
+    apply_search_params,
+    embed_documents,
+    get_build_params,
+    get_metric,
+    prepare_vectors,
+    relevance_scores
+)
+from cancer_rag.ai.index_sync import ReadWriteLock, IndexSyncWorker
+from cancer_rag.ai.partitions import (
+    get_partition_config,
+    partitions_enabled,
+    assign_partitions,
+    build_partition_indexes,
+    get_disease_site,
+    query_partitions
+)
+from cancer_rag.ai.embedder import (
+    BatchingEmbeddings,
+    CachedEmbeddings,
+    EMBEDDING_BATCHING_DEFAULTS,
+    EMBEDDING_CACHE_DEFAULTS,
+    embedder_identity,
+    embed_queries,
+    init_onnx_embedder
+)
+from cancer_rag.ai.reranker import get_reranker_config, load_cross_encoder, CrossEncoderReranker
+from cancer_rag.ai.lexical import BM25Index, get_lexical_config, lexical_texts, reciprocal_rank_fusion
+from cancer_rag.ai.result_cache import get_result_cache_config, SemanticResultCache
+from cancer_rag.ai.passages import get_passage_config, passage_parents, row_vectors, merge_windows, PassageStore
 
-question_vector_store = None
-answers_vector_store = None
-similarity_top_k = 10
-similarity_threshold = 0.5
-corpus_data = None
+INDEX_LOAD_MODES = ["memory", "mmap"]
+SEARCH_MODES = ["question_first", "merged"]
+STORE_WEIGHT_DEFAULTS = {"question" : 1.0, "answer" : 0.9}
+# Passage hits fetched per requested answer when answers are split into passages
+PASSAGE_OVERFETCH = 3
+# Runs the answer store search of merged mode next to the question store search, FAISS releases the GIL
+STORE_SEARCH_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="store-search")
 
 def init_embedder(embedder_config, device):
     embedder_params = embedder_config['params']
@@ -42,104 +87,741 @@ def init_embedder(embedder_config, device):
     elif embedder_config['backend'] == "OLLAMA":
         embedder = OllamaEmbeddings(model=embedder_params['model_name'])
         print(f"Embedder Initialized with {embedder_params['model_name']}")
+    elif embedder_config['backend'] == "ONNX":
+        # CPU only, device is ignored
+        embedder = init_onnx_embedder(embedder_params)
     else:
         raise NotImplementedError("Embedder backend not supported")
+
+    if embedder_config.get('batching'):
+        # Below the cache so only cache misses wait for a batch
+        batching_config = {**EMBEDDING_BATCHING_DEFAULTS, **embedder_config['batching']}
+        embedder = BatchingEmbeddings(
+            embedder, max_batch_size=batching_config['max_batch_size'], max_wait_ms=batching_config['max_wait_ms']
+        )
+        print(f"Query embedding micro-batching enabled ({batching_config['max_batch_size']} texts, {batching_config['max_wait_ms']}ms window)")
+
+    if embedder_config.get('cache'):
+        cache_config = {**EMBEDDING_CACHE_DEFAULTS, **embedder_config['cache']}
+        embedder = CachedEmbeddings(
+            embedder, embedder_identity(embedder_config),
+            max_size=cache_config['max_size'], ttl_seconds=cache_config['ttl_seconds']
+        )
+        print(f"Query embedding cache enabled ({cache_config['max_size']} entries, ttl {cache_config['ttl_seconds']}s)")
     return embedder
 
 
-def init_vectorstore(embedder):
-    # Create the FAISS index for storing embeddings
-    embedding_size = len(embedder.embed_query("hello world"))  # Example to get embedding size
-    question_index = faiss.IndexFlatL2(embedding_size)
-    answer_index = faiss.IndexFlatL2(embedding_size)
-    question_vector_store = FAISS(
-        embedding_function=embedder,
-        index=question_index,
-        docstore=InMemoryDocstore(),
-        index_to_docstore_id={}
-    )
-
-    answers_vector_store = FAISS(
-        embedding_function=embedder,
-        index=answer_index,
-        docstore=InMemoryDocstore(),
-        index_to_docstore_id={}
-    )
-    return question_vector_store, answers_vector_store
+def build_lexical_index(corpus_store, lexical_config):
+    return BM25Index.build(lexical_texts(corpus_store), k1=lexical_config['k1'], b=lexical_config['b'])
+
+
+def build_artifact(corpus_data, embedder, index_config):
+    """
+    Preprocess and embed a corpus and build every index over it.
+    Returns the artifact dict save_index_artifact writes and Retriever serves
+    """
+    # Preprocesses the Question and Answer columns in place
+    passage_config = get_passage_config(index_config)
+    question_documents, answer_documents = create_documents_from_df(corpus_data, passage_config=passage_config)
+    # Embed up front so approximate indexes can be trained before the vectors are added
+    question_vectors = embed_documents(embedder, question_documents, index_config)
+    answer_vectors = embed_documents(embedder, answer_documents, index_config)
+    passage_store = None
+    if passage_config is not None:
+        passage_store = PassageStore.from_documents(answer_documents, passage_parents(corpus_data, answer_documents))
+        print(f"{len(corpus_data)} Answers split into {len(passage_store)} passages")
+
+    aliases = np.zeros((0, 2), dtype=np.int64)
+    dedup_config = get_dedup_config(index_config)
+    if dedup_config is not None:
+        # Duplicates are judged on whole answers, a passage split answer is the mean of its passages
+        row_answer_vectors = answer_vectors if passage_store is None else row_vectors(answer_vectors, passage_store.parents, len(corpus_data))
+        kept_data, question_vectors, row_answer_vectors, alias_ids, canonical_ids = collapse_duplicates(
+            corpus_data, question_vectors, row_answer_vectors, dedup_config
+        )
+        if passage_store is None:
+            answer_vectors = row_answer_vectors
+        else:
+            passage_store, passage_keep = passage_store.select(corpus_data.index.isin(kept_data.index))
+            answer_vectors = np.ascontiguousarray(answer_vectors[passage_keep])
+        corpus_data = kept_data
+        aliases = np.stack([alias_ids, canonical_ids], axis=1)
+
+    question_index = build_index(question_vectors, index_config)
+    question_index.add(question_vectors)
+    print(f"{len(question_vectors)} Documents added to Questions Index")
+    answer_index = build_index(answer_vectors, index_config)
+    answer_index.add(answer_vectors)
+    print(f"{len(answer_vectors)} Documents added to Answers Index")
+
+    corpus_store = CorpusStore.from_df(corpus_data, snippets=index_config.get('snippets', False))
+    partitions, lexical_index = {}, None
+    if partitions_enabled(index_config):
+        labels = assign_partitions(corpus_data, get_partition_config(index_config))
+        partitions = build_partition_indexes(
+            question_vectors, answer_vectors, labels, index_config,
+            answer_parents=None if passage_store is None else passage_store.parents
+        )
+    lexical_config = get_lexical_config(index_config)
+    if lexical_config is not None:
+        # The corpus holds preprocess_text output at this point, the same text the embedder saw
+        lexical_index = build_lexical_index(corpus_store, lexical_config)
+
+    return {
+        "question_index" : question_index,
+        "answer_index" : answer_index,
+        "ids" : np.asarray(corpus_data.index, dtype=np.int64),
+        "aliases" : aliases,
+        "corpus_store" : corpus_store,
+        "partitions" : partitions,
+        "lexical_index" : lexical_index,
+        "passage_store" : passage_store,
+    }
+
+
+def check_bundle_compatible(manifest, embedder_config, index_config):
+    # A bundle is only servable with the embedder that produced its vectors and the same build settings
+    assert embedder_identity(manifest['embedder_config']) == embedder_identity(embedder_config), \
+        f"Bundle was built with embedder {embedder_identity(manifest['embedder_config'])}, config has {embedder_identity(embedder_config)}"
+    build_params = json.loads(json.dumps(get_build_params(index_config)))
+    assert manifest['build_params'] == build_params, \
+        f"Bundle was built with index params {manifest['build_params']}, config has {build_params}. Rebuild it with scripts/build_index.py"
+
 
 def calculate_max_similarity(sims):
     if len(sims) == 0:
         return -1
     return float(np.max(np.array(sims)))
 
-# Define Custom Functions as Runnables to use in retrieval chain
-@chain
-def retriever(query: dict) -> List[Document]:
-    """Custom Retriever Logic to filter based on SIM THRESHOLD"""
-    global question_vector_store, answers_vector_store, similarity_top_k, similarity_threshold
-    print("Running Retriever Chain")
-    query = preprocess_text(query.get('query',''))
-    print("Performing Questions Level Retrieval")
-    docs, scores = zip(*question_vector_store.similarity_search_with_relevance_scores(query, k=similarity_top_k))
-    result = []
-    for doc, score in zip(docs, scores):
-        if score > similarity_threshold:
-            doc.metadata["score"] = score
-            result.append(doc)
-
-    print("Performing Answers Level Retrieval")
-    if len(result) == 0:
-        docs, scores = zip(*answers_vector_store.similarity_search_with_relevance_scores(query, k=similarity_top_k)) 
-        for doc, score in zip(docs, scores):
-            if score > similarity_threshold:
-                doc.metadata["score"] = score
-                result.append(doc)        
-    return result
-
-@chain
-def format_retrieved_docs(documents: List[Document]) -> str:
-    """Context Formatter"""
-    global corpus_data
-    print("Formatting Retrieved Documents")
-    docs = []
-    for doc in documents:
-        score = doc.metadata.get('score')
-        index = doc.metadata.get('id')
-        answer = corpus_data.iloc[index].Answer
-        question = corpus_data.iloc[index].Question
-        docs.append((question, answer, score))
-
-    context_text = "\n".join([f"Q: {ctx[0]}\nA: {ctx[1]}" for ctx in docs])
-    #mean_sim = calculate_mean_similarity([ctx[2] for ctx in docs])
-    max_sim = calculate_max_similarity([ctx[2] for ctx in docs])
-    print(context_text, max_sim)
-    return {"context" : context_text, "retrieval_score" : max_sim}
+class Retriever:
+    """
+    Retrieval engine for one corpus. Owns its FAISS indexes, corpus and thresholds;
+    the embedder is passed in so several corpora can share one loaded model.
+
+    FAISS positions line up with corpus rows, index_ids holds the source id (session_chat.id for
+    database corpora) of each position and active_mask drops rows un-verified after indexing.
+    Corpus text lives in a CorpusStore of contiguous string columns, retrieved Documents carry only
+    the corpus position and score. In mmap mode the indexes and corpus text are mapped read-only
+    from the index artifact.
+
+    With index partitions configured, each disease site also gets its own sub-indexes and queries
+    with a known disease_site only search the matching sites plus the general partition.
+
+    With a lexical config, a BM25 index over the same corpus rows runs first. A decisive lexical match
+    skips the dense search, otherwise lexical and dense hits are fused by reciprocal rank.
+
+    With a dedup config, near-duplicate rows are collapsed into one canonical row at build time and
+    aliases keeps the (alias id, canonical id) pairs of the dropped rows.
+
+    The question store is searched first and the answer store only for queries without a question hit,
+    unless search_mode is merged, where both are searched concurrently and merged by corpus row.
+
+    With a passages config, answers are indexed as sentence window passages. Answer index positions
+    are then passage positions, passage_store maps them to their corpus row and a row found through
+    its passages is formatted as its question plus only the matching passages.
+
+    An optional cross-encoder reranker rescores the retrieved hits before formatting.
+
+    With a result cache, formatted contexts of recent queries are reused for queries whose embedding
+    is within a cosine radius of theirs, without searching.
+
+    With a bundle_path the indexes come from a bundle prebuilt by scripts/build_index.py and the
+    datasource is only read by the sync worker.
+    """
+    def __init__(self, name, embedder, embedder_config, datasource, retriever_config, reranker=None):
+        print(f"Initializing Retriever {name}")
+        self.name = name
+        self.embedder = embedder
+        self.reranker = reranker
+        self.embedder_config = embedder_config
+        self.datasource = datasource
+        self.similarity_top_k = retriever_config.get('similarity_top_k', 10)
+        self.similarity_threshold = retriever_config.get('similarity_threshold', 0.5)
+        self.search_mode = retriever_config.get('search_mode', 'question_first')
+        assert self.search_mode in SEARCH_MODES, f"search_mode must be one of {SEARCH_MODES}"
+        self.store_weights = {**STORE_WEIGHT_DEFAULTS, **(retriever_config.get('store_weights') or {})}
+        self.index_config = retriever_config.get('index', {})
+        self.partition_config = get_partition_config(self.index_config)
+        self.lexical_config = get_lexical_config(self.index_config)
+        self.dedup_config = get_dedup_config(self.index_config)
+        self.result_cache_config = get_result_cache_config(retriever_config)
+        self.passage_config = get_passage_config(self.index_config)
+        self.index_cache_dir = retriever_config.get('index_cache_dir')
+        self.index_cache_keep = retriever_config.get('index_cache_keep', INDEX_CACHE_KEEP)
+        self.index_load_mode = retriever_config.get('index_load_mode', 'memory')
+        assert self.index_load_mode in INDEX_LOAD_MODES, f"index_load_mode must be one of {INDEX_LOAD_MODES}"
+        # Offline bundle from scripts/build_index.py, served as is instead of loading and embedding the datasource
+        self.bundle_path = retriever_config.get('bundle_path')
+        self.bundle_verify = retriever_config.get('bundle_verify', True)
+        assert self.index_cache_dir or self.bundle_path or self.index_load_mode != "mmap", \
+            "index_load_mode mmap requires index_cache_dir or bundle_path"
+
+        self.question_index = None
+        self.answer_index = None
+        self.corpus_store = None
+        # partition name -> {"positions", "question_index", "answer_index"}, positions map back to corpus rows
+        self.partitions = {}
+        self.lexical_index = None
+        # Answer index positions are passages of the answers when they are split, parents maps them to corpus rows
+        self.passage_store = None
+        self.result_cache = None
+        # Bumped by every sync that changes the corpus, cached results of an older version are dropped
+        self.corpus_version = 0
+        # Searches share the indexes with the sync thread, which only takes the write lock to append
+        self.lock = ReadWriteLock()
+        self.sync_worker = None
+
+        self.load_indexes()
+        if self.result_cache_config is not None:
+            self.result_cache = SemanticResultCache(
+                self.question_index.d,
+                min_similarity=self.result_cache_config['min_similarity'],
+                max_size=self.result_cache_config['max_size'],
+                neighbours=self.result_cache_config['neighbours']
+            )
+        self.retriever = VectorizedRunnable(self.retrieve, self.retrieve_batch, name="retriever")
+        self.retrieve_with_query = VectorizedRunnable(
+            lambda query: (query, self.retrieve(query)),
+            lambda queries: list(zip(queries, self.retrieve_batch(queries))),
+            name="retrieve_with_query"
+        )
+        self.rerank = VectorizedRunnable(self.rerank_docs, self.rerank_docs_batch, name="rerank")
+        self.format_retrieved_docs = VectorizedRunnable(self.format_docs, self.format_docs_batch, name="format_retrieved_docs")
+        self.cached_context = VectorizedRunnable(self.cached_context_one, self.cached_context_batch, name="semantic_result_cache")
+
+        sync_interval = retriever_config.get('sync_interval_seconds', 0)
+        if sync_interval and is_db_datasource(datasource):
+            self.start_sync(sync_interval)
+
+    @property
+    def mmap(self):
+        return self.index_load_mode == "mmap"
+
+    def load_indexes(self):
+        if self.bundle_path:
+            # Prebuilt offline, the corpus is neither loaded nor embedded here
+            artifact = load_bundle(self.bundle_path, mmap=self.mmap, verify=self.bundle_verify)
+            check_bundle_compatible(artifact['manifest'], self.embedder_config, self.index_config)
+        else:
+            corpus_data = load_data(self.datasource)
+
+            # Reuse the on-disk index artifact when the corpus and embedder are unchanged
+            index_hash = compute_index_hash(corpus_data, self.embedder_config, self.index_config)
+            artifact = load_index_artifact(self.index_cache_dir, index_hash, mmap=self.mmap) if self.index_cache_dir else None
+
+            if artifact is None:
+                artifact = build_artifact(corpus_data, self.embedder, self.index_config)
+                saved = False
+                if self.index_cache_dir:
+                    try:
+                        save_index_artifact(
+                            artifact_path(self.index_cache_dir, index_hash), index_hash, artifact,
+                            self.embedder_config, self.index_config
+                        )
+                        saved = True
+                    except OSError as e:
+                        print(f"Index artifact not cached in {self.index_cache_dir}, serving the indexes from memory: {e}")
+                    if saved and self.index_cache_keep:
+                        prune_index_cache(self.index_cache_dir, self.index_cache_keep, index_hash)
+                if self.mmap and saved:
+                    # Drop the private copies just built and serve from the shared mapping like every other worker
+                    mapped_artifact = load_index_artifact(self.index_cache_dir, index_hash, mmap=True)
+                    if mapped_artifact is not None:
+                        artifact = mapped_artifact
+                    else:
+                        print(f"Index artifact {index_hash[:12]} could not be mapped, serving the indexes from memory")
+
+        self.question_index = artifact['question_index']
+        self.answer_index = artifact['answer_index']
+        self.index_ids = artifact['ids']
+        self.aliases = artifact['aliases']
+        self.corpus_store = artifact['corpus_store']
+        self.partitions = artifact['partitions']
+        self.lexical_index = artifact['lexical_index']
+        self.passage_store = artifact.get('passage_store')
+        self.active_mask = np.ones(len(self.index_ids), dtype=bool)
+        # efSearch / nprobe are query time settings, so they can change without rebuilding
+        apply_search_params(self.question_index, self.index_config)
+        apply_search_params(self.answer_index, self.index_config)
+        for partition in self.partitions.values():
+            apply_search_params(partition['question_index'], self.index_config)
+            apply_search_params(partition['answer_index'], self.index_config)
+        print(f"Worker memory after {self.name} index load: {get_worker_memory()}")
+
+    def embed_queries(self, queries):
+        query_vectors = np.array(embed_queries(self.embedder, queries), dtype=np.float32)
+        return prepare_vectors(query_vectors, self.index_config)
+
+    def search_by_vector(self, index, query_vectors, k, index_positions=None, parents=None):
+        """
+        Search a raw FAISS index with a (num_queries, dim) matrix.
+        index_positions maps the positions of a partition sub-index back to corpus positions
+        (passage positions for a passage split answer index, whose corpus rows are in parents).
+        Returns (positions, relevance scores, valid mask) arrays
+        """
+        active_mask = self.active_mask if parents is None else self.active_mask[parents]
+        # Over-fetch by the number of removed rows so they can be dropped without losing top_k hits
+        num_inactive = int(len(active_mask) - np.count_nonzero(active_mask))
+        distances, positions = index.search(query_vectors, k + num_inactive)
+        found = positions != -1
+        if index_positions is not None:
+            positions = np.where(found, index_positions[np.where(found, positions, 0)], -1)
+        scores = relevance_scores(distances, get_metric(self.index_config))
+        valid = found & active_mask[np.where(found, positions, 0)]
+        return positions, scores, valid
+
+    def passage_rows(self, passages):
+        # Corpus row of each passage position, -1 stays -1
+        return np.where(passages >= 0, self.passage_store.parents[np.maximum(passages, 0)], -1)
+
+    def search_answers(self, partition_names, query_vectors, k):
+        """Answer level search. Returns (corpus positions, scores, valid, passage positions or None)"""
+        if self.passage_store is None:
+            return (*self.search_level("answer_index", partition_names, query_vectors, k), None)
+        # Several passages of one answer can match, fetch extra so top_k distinct answers remain
+        passages, scores, valid = self.search_level("answer_index", partition_names, query_vectors, k * PASSAGE_OVERFETCH)
+        return self.passage_rows(passages), scores, valid, passages
+
+    def search_level(self, level, partition_names, query_vectors, k):
+        """Search the full index of a level, or only the given partitions merged by score"""
+        parents = None
+        if level == "answer_index" and self.passage_store is not None:
+            parents = self.passage_store.parents
+        if partition_names is None:
+            return self.search_by_vector(getattr(self, level), query_vectors, k, parents=parents)
+        positions_key = "answer_positions" if parents is not None else "positions"
+        results = [
+            self.search_by_vector(self.partitions[name][level], query_vectors, k, self.partitions[name][positions_key], parents)
+            for name in partition_names
+        ]
+        positions, scores, valid = [np.concatenate(arrays, axis=1) for arrays in zip(*results)]
+        # Higher is better for both metrics, invalid hits sort last
+        order = np.argsort(-np.where(valid, scores, -np.inf), axis=1, kind='stable')
+        return [np.take_along_axis(array, order, axis=1) for array in (positions, scores, valid)]
+
+    def partition_mask(self, partition_names):
+        # Corpus positions searchable for a set of partitions
+        if partition_names is None:
+            return self.active_mask
+        mask = np.zeros(len(self.active_mask), dtype=bool)
+        for name in partition_names:
+            mask[self.partitions[name]['positions']] = True
+        return mask & self.active_mask
+
+    def lexical_search(self, texts, query_sites):
+        """BM25 top_k per query over its partitions. Returns (positions, scores, valid) like search_by_vector"""
+        k = self.similarity_top_k
+        positions = np.full((len(texts), k), -1, dtype=np.int64)
+        scores = np.zeros((len(texts), k), dtype=np.float32)
+        for partition_names in dict.fromkeys(query_sites):
+            rows = [row for row, names in enumerate(query_sites) if names == partition_names]
+            group_positions, group_scores, _ = self.lexical_index.search(
+                [texts[row] for row in rows], k, self.partition_mask(partition_names)
+            )
+            positions[rows, :group_positions.shape[1]] = group_positions
+            scores[rows, :group_scores.shape[1]] = group_scores
+        return positions, scores, scores > 0
+
+    def decisive_rows(self, lexical_hits):
+        # A top lexical hit that is strong on its own and well clear of the runner-up
+        positions, scores, valid = lexical_hits
+        runner_up = scores[:, 1] if scores.shape[1] > 1 else np.zeros(len(scores), dtype=np.float32)
+        decisive = valid[:, 0] & (scores[:, 0] >= self.lexical_config['skip_dense_score'])
+        decisive &= scores[:, 0] - runner_up >= self.lexical_config['skip_dense_margin']
+        return np.flatnonzero(decisive)
+
+    def fuse_hits(self, positions, scores, keep, lexical_positions, lexical_scores, lexical_keep, passages=None):
+        """
+        Reciprocal rank fusion of the dense and lexical hits that passed their own threshold.
+        Each document keeps the higher of its dense relevance and normalized BM25 score
+        """
+        dense_documents = self.to_documents(positions, scores, keep, passages, top_k=len(positions))
+        doc_scores = {int(position) : float(score) for position, score in zip(lexical_positions[lexical_keep], lexical_scores[lexical_keep])}
+        doc_passages = {}
+        for doc in dense_documents:
+            position = doc.metadata['id']
+            doc_scores[position] = max(doc.metadata['score'], doc_scores.get(position, -1.0))
+            if 'passages' in doc.metadata:
+                doc_passages[position] = doc.metadata['passages']
+        fused = reciprocal_rank_fusion(
+            [[doc.metadata['id'] for doc in dense_documents], lexical_positions[lexical_keep].tolist()], self.lexical_config['rrf_k']
+        )
+        documents = []
+        for position in fused[:self.similarity_top_k]:
+            metadata = {"id" : position, "score" : doc_scores[position]}
+            if position in doc_passages:
+                metadata['passages'] = doc_passages[position]
+            documents.append(Document(page_content="", metadata=metadata))
+        return documents
+
+    def filter_hits(self, positions, scores, valid):
+        # Threshold mask shared by the question and answer level search
+        return valid & (scores > self.similarity_threshold)
+
+    def to_documents(self, positions, scores, keep, passages=None, top_k=None):
+        """
+        Documents for the first top_k distinct corpus rows among the kept hits, each with its best score.
+        Rows found only through answer passages list them, rows with a question or whole answer hit do not
+        """
+        top_k = top_k or self.similarity_top_k
+        documents, whole_rows = {}, set()
+        for i in np.flatnonzero(keep):
+            position = int(positions[i])
+            if position not in documents:
+                if len(documents) == top_k:
+                    continue
+                documents[position] = Document(page_content="", metadata={"id" : position, "score" : float(scores[i])})
+            if passages is None or passages[i] < 0:
+                whole_rows.add(position)
+            else:
+                documents[position].metadata.setdefault('passages', []).append(int(passages[i]))
+        for position in whole_rows:
+            documents[position].metadata.pop('passages', None)
+        return list(documents.values())
+
+    def query_scope(self, query):
+        # Partitions a query searches, None searches the full index
+        if not self.partitions:
+            return None
+        # The index sync adds partitions for unseen sites under the write lock
+        with self.lock.read():
+            return query_partitions(get_disease_site(query), self.partition_config, self.partitions)
+
+    def retrieve_batch(self, queries: List[dict], query_vectors=None) -> List[List[Document]]:
+        """
+        Custom Retriever Logic to filter based on SIM THRESHOLD, vectorized over a batch of queries.
+        query_vectors are the already embedded queries, if the caller has them
+        """
+        print(f"Running Retriever Chain ({len(queries)} queries)")
+        texts = [preprocess_text(query.get('query','')) for query in queries]
+        # Queries are grouped by the partitions they search
+        query_sites = [self.query_scope(query) for query in queries]
+        results = [None] * len(queries)
+
+        # Cheap lexical pass first, decisive matches are answered without embedding the query
+        lexical_hits = None
+        if self.lexical_index is not None:
+            with self.lock.read():
+                lexical_hits = self.lexical_search(texts, query_sites)
+            decisive_rows = self.decisive_rows(lexical_hits)
+            if len(decisive_rows) > 0:
+                print(f"Decisive lexical match for {len(decisive_rows)} queries, skipping dense search")
+            for row in decisive_rows:
+                positions, scores, valid = [array[row] for array in lexical_hits]
+                results[row] = self.to_documents(positions, scores, valid & (scores >= self.lexical_config['min_score']))
+
+        dense_rows = [row for row in range(len(queries)) if results[row] is None]
+        if len(dense_rows) == 0:
+            return results
+        # Embed once and reuse the vectors for both the question and answer level search
+        if query_vectors is None:
+            query_vectors = self.embed_queries([texts[row] for row in dense_rows])
+        else:
+            query_vectors = query_vectors[dense_rows]
+
+        with self.lock.read():
+            for partition_names in dict.fromkeys(query_sites[row] for row in dense_rows):
+                group = [i for i, row in enumerate(dense_rows) if query_sites[row] == partition_names]
+                rows = [dense_rows[i] for i in group]
+                if partition_names is not None:
+                    print(f"Searching partitions {', '.join(partition_names)} for {len(rows)} queries")
+                group_lexical = None if lexical_hits is None else [array[rows] for array in lexical_hits]
+                for row, documents in zip(rows, self.retrieve_vectors(query_vectors[group], partition_names, group_lexical)):
+                    results[row] = documents
+        return results
+
+    def search_merged(self, query_vectors, partition_names=None):
+        """
+        Search the question and answer stores concurrently and merge their thresholded hits by corpus row.
+        Hits are ranked by store weight * relevance and keep their raw relevance as score.
+        Returns (positions, scores, keep, passages), passages is -1 for question and whole answer hits
+        """
+        k = self.similarity_top_k
+        answer_search = STORE_SEARCH_EXECUTOR.submit(self.search_answers, partition_names, query_vectors, k)
+        question_hits = self.search_level("question_index", partition_names, query_vectors, k)
+        *answer_hits, answer_passages = answer_search.result()
+
+        positions = np.concatenate([question_hits[0], answer_hits[0]], axis=1)
+        scores = np.concatenate([question_hits[1], answer_hits[1]], axis=1)
+        keep = np.concatenate([self.filter_hits(*question_hits), self.filter_hits(*answer_hits)], axis=1)
+        if answer_passages is None:
+            answer_passages = np.full(answer_hits[0].shape, -1, dtype=np.int64)
+        passages = np.concatenate([np.full(question_hits[0].shape, -1, dtype=np.int64), answer_passages], axis=1)
+        weights = np.repeat([self.store_weights['question'], self.store_weights['answer']], [question_hits[0].shape[1], answer_hits[0].shape[1]])
+        order = np.argsort(-np.where(keep, scores * weights, -np.inf), axis=1, kind='stable')
+        # A row matched on both its question and answer becomes one document at its better weighted rank
+        return [np.take_along_axis(array, order, axis=1) for array in (positions, scores, keep, passages)]
+
+    def retrieve_vectors(self, query_vectors, partition_names=None, lexical_hits=None):
+        if self.search_mode == "merged":
+            print("Performing Merged Questions and Answers Retrieval")
+            positions, scores, keep, passages = self.search_merged(query_vectors, partition_names)
+        else:
+            print("Performing Questions Level Retrieval")
+            positions, scores, valid = self.search_level("question_index", partition_names, query_vectors, self.similarity_top_k)
+            keep, passages = self.filter_hits(positions, scores, valid), None
+        row_passages = lambda row: None if passages is None else passages[row]
+        if lexical_hits is None:
+            results = [self.to_documents(positions[row], scores[row], keep[row], row_passages(row)) for row in range(len(query_vectors))]
+        else:
+            lexical_positions, lexical_scores, lexical_valid = lexical_hits
+            lexical_keep = lexical_valid & (lexical_scores >= self.lexical_config['min_score'])
+            results = [
+                self.fuse_hits(
+                    positions[row], scores[row], keep[row], lexical_positions[row], lexical_scores[row], lexical_keep[row], row_passages(row)
+                )
+                for row in range(len(query_vectors))
+            ]
+            keep = keep | lexical_keep.any(axis=1, keepdims=True)
+
+        if self.search_mode == "merged":
+            return results
+        # Only queries with no question level hit fall back to the answers store
+        fallback_rows = np.flatnonzero(~keep.any(axis=1))
+        if len(fallback_rows) > 0:
+            print(f"Performing Answers Level Retrieval for {len(fallback_rows)} queries")
+            positions, scores, valid, passages = self.search_answers(partition_names, query_vectors[fallback_rows], self.similarity_top_k)
+            keep = self.filter_hits(positions, scores, valid)
+            for i, row in enumerate(fallback_rows):
+                results[row] = self.to_documents(positions[i], scores[i], keep[i], row_passages(i))
+        return results
+
+    def retrieve(self, query: dict) -> List[Document]:
+        return self.retrieve_batch([query])[0]
+
+    def document_text(self, position):
+        # Text a retrieved corpus row is reranked on
+        return f"{self.corpus_store.question(position)} {self.corpus_store.answer(position)}"
+
+    def rerank_docs(self, query_documents):
+        return self.rerank_docs_batch([query_documents])[0]
+
+    def rerank_docs_batch(self, query_documents_list):
+        """Rerank (query, documents) pairs from retrieve_with_query in one cross-encoder batch"""
+        print(f"Reranking Retrieved Documents ({len(query_documents_list)} queries)")
+        query_texts = [preprocess_text(query.get('query','')) for query, _ in query_documents_list]
+        documents_list = [documents for _, documents in query_documents_list]
+        return self.reranker.rerank_batch(query_texts, documents_list, self.document_text)
+
+    def context_text(self, document):
+        # Rows found through answer passages send only those passages under their question
+        position, passages = document.metadata.get('id'), document.metadata.get('passages')
+        if not passages:
+            return self.corpus_store.snippet(position)
+        passages = sorted(passages)
+        return format_snippet(
+            self.corpus_store.question(position),
+            merge_windows([self.passage_store.text(i) for i in passages], passages, self.passage_config)
+        )
+
+    def format_docs(self, documents: List[Document]) -> str:
+        """Context Formatter"""
+        print("Formatting Retrieved Documents")
+        context_text = "\n".join([self.context_text(doc) for doc in documents])
+        #mean_sim = calculate_mean_similarity([doc.metadata.get('score') for doc in documents])
+        max_sim = calculate_max_similarity([doc.metadata.get('score') for doc in documents])
+        print(context_text, max_sim)
+        return {"context" : context_text, "retrieval_score" : max_sim}
+
+    def format_docs_batch(self, documents_list: List[List[Document]]) -> List[dict]:
+        return [self.format_docs(documents) for documents in documents_list]
+
+    def cached_context_one(self, query):
+        return self.cached_context_batch([query])[0]
+
+    def cached_context_batch(self, queries):
+        """
+        Formatted contexts, queries close to a recent query with the same scope reuse its result.
+        The rest are retrieved, reranked and formatted with the vectors embedded for the lookup
+        """
+        texts = [preprocess_text(query.get('query','')) for query in queries]
+        scopes = [self.query_scope(query) for query in queries]
+        version = self.corpus_version
+        query_vectors = self.embed_queries(texts)
+        results = self.result_cache.lookup(query_vectors, scopes, version)
+        miss_rows = [row for row, result in enumerate(results) if result is None]
+        print(f"Semantic result cache: {len(queries) - len(miss_rows)} of {len(queries)} queries served from cache")
+        if miss_rows:
+            miss_queries = [queries[row] for row in miss_rows]
+            documents_list = self.retrieve_batch(miss_queries, query_vectors[miss_rows])
+            if self.reranker is not None:
+                documents_list = self.rerank_docs_batch(list(zip(miss_queries, documents_list)))
+            new_results = self.format_docs_batch(documents_list)
+            self.result_cache.store(query_vectors[miss_rows], [scopes[row] for row in miss_rows], new_results, version)
+            for row, result in zip(miss_rows, new_results):
+                results[row] = result
+        # Callers get their own dict, the cached one is shared
+        return [dict(result) for result in results]
+
+    def sync_verified_rows(self):
+        """
+        Embed rows verified since the index was built and append them to both stores and the corpus.
+        Rows that are no longer verified are masked out; FAISS positions stay aligned with corpus rows.
+        """
+        active_rows = set(self.index_ids[self.active_mask].tolist())
+        # Aliases of active canonical rows are already represented in the index
+        active_ids = active_rows | {alias_id for alias_id, canonical_id in self.aliases.tolist() if canonical_id in active_rows}
+        # Collapsed aliases count as indexed, otherwise a trailing alias would come back as a new row
+        last_id = int(max(self.index_ids.max(initial=0), self.aliases[:, 0].max(initial=0)))
+        new_data, removed_ids = load_verified_changes_from_db(last_id, active_ids, self.aliases.tolist())
+        if len(new_data) == 0 and len(removed_ids) == 0:
+            return
+
+        # An un-verified alias only leaves the alias list, its canonical row stays searchable.
+        # Verified aliases of an un-verified canonical row come back with new_data and are indexed as rows.
+        # Only the sync thread reads the aliases, so they are replaced outside the lock
+        removed_aliases = removed_ids - active_rows
+        new_ids = new_data.index.tolist()
+        promoted = set(new_ids) & set(self.aliases[:, 0].tolist())
+        if removed_aliases or promoted:
+            self.aliases = self.aliases[~np.isin(self.aliases[:, 0], list(removed_aliases | promoted))]
+        removed_ids = removed_ids & active_rows
+        if len(new_ids) == 0:
+            # Nothing to embed, the stores and postings are unchanged and only the mask moves
+            if removed_ids:
+                with self.lock.write():
+                    self.active_mask = self.active_mask & ~np.isin(self.index_ids, list(removed_ids))
+                    self.corpus_version += 1
+            print(f"Index sync ({self.name}): 0 rows added, {len(removed_ids)} rows removed, {len(removed_aliases)} aliases dropped")
+            return
+
+        # Embedding is the slow part and runs without blocking searches.
+        # Re-verified rows get a new position, their old one stays masked
+        question_documents, answer_documents = create_documents_from_df(new_data, passage_config=self.passage_config)
+        question_vectors = embed_documents(self.embedder, question_documents, self.index_config)
+        answer_vectors = embed_documents(self.embedder, answer_documents, self.index_config)
+        labels = assign_partitions(new_data, self.partition_config) if self.partitions else []
+        # The sync thread is the only writer, so the sizes can be read outside the lock
+        num_indexed = len(self.active_mask)
+        passage_store, answer_parents, num_passages = None, None, 0
+        if self.passage_store is not None:
+            answer_parents, num_passages = passage_parents(new_data, answer_documents), len(self.passage_store)
+            passage_store = self.passage_store.extend([doc.page_content for doc in answer_documents], num_indexed + answer_parents)
+        corpus_store = self.corpus_store.extend(new_data)
+        # BM25 idf and length norms depend on the whole corpus, so the postings are rebuilt
+        lexical_index = build_lexical_index(corpus_store, self.lexical_config) if self.lexical_index is not None else None
+
+        with self.lock.write():
+            # Corpus rows go in before their vectors so every searchable position can be formatted
+            self.corpus_store = corpus_store
+            self.lexical_index = lexical_index
+            if passage_store is not None:
+                self.passage_store = passage_store
+            self.question_index.add(question_vectors)
+            self.answer_index.add(answer_vectors)
+            self.add_to_partitions(labels, question_vectors, answer_vectors, num_indexed, answer_parents, num_passages)
+            self.index_ids = np.concatenate([self.index_ids, np.array(new_ids, dtype=np.int64)])
+            mask = np.concatenate([self.active_mask, np.ones(len(new_ids), dtype=bool)])
+            mask[:num_indexed] &= ~np.isin(self.index_ids[:num_indexed], list(removed_ids))
+            self.active_mask = mask
+            self.corpus_version += 1
+        print(f"Index sync ({self.name}): {len(new_ids)} rows added ({len(promoted)} promoted aliases), {len(removed_ids)} rows removed, {len(removed_aliases)} aliases dropped")
+
+    def add_to_partitions(self, labels, question_vectors, answer_vectors, first_position, answer_parents=None, first_passage=0):
+        """
+        New rows take corpus positions first_position onwards, unseen sites get a new partition.
+        With answer passages, answer_parents maps the answer vectors to the new rows and they take
+        passage positions first_passage onwards
+        """
+        if len(labels) == 0:
+            return
+        answer_labels = labels if answer_parents is None else labels[answer_parents]
+        for label in sorted(set(labels)):
+            rows = np.flatnonzero(labels == label)
+            answer_rows = rows if answer_parents is None else np.flatnonzero(answer_labels == label)
+            if label not in self.partitions:
+                self.partitions[label] = {
+                    "positions" : np.zeros(0, dtype=np.int64),
+                    "question_index" : build_index(question_vectors[rows], self.index_config),
+                    "answer_index" : build_index(answer_vectors[answer_rows], self.index_config),
+                }
+                if answer_parents is not None:
+                    self.partitions[label]['answer_positions'] = np.zeros(0, dtype=np.int64)
+            partition = self.partitions[label]
+            partition['question_index'].add(np.ascontiguousarray(question_vectors[rows]))
+            partition['answer_index'].add(np.ascontiguousarray(answer_vectors[answer_rows]))
+            partition['positions'] = np.concatenate([partition['positions'], first_position + rows])
+            if answer_parents is not None:
+                partition['answer_positions'] = np.concatenate([partition['answer_positions'], first_passage + answer_rows])
+
+    def start_sync(self, interval_seconds):
+        # Pick up newly verified answers from the database without a restart
+        if self.mmap:
+            print("Index sync disabled, mmap indexes are read-only")
+            return
+        if self.sync_worker is None:
+            self.sync_worker = IndexSyncWorker(self.sync_verified_rows, interval_seconds)
+            self.sync_worker.start()
+
+    def as_chain(self):
+        if self.result_cache is not None:
+            return self.cached_context
+        if self.reranker is None:
+            return self.retriever | self.format_retrieved_docs
+        return self.retrieve_with_query | self.rerank | self.format_retrieved_docs
+
+
+class RetrieverRegistry:
+    """Named Retrievers, embedders are loaded once per (embedder config, device) and shared"""
+    def __init__(self):
+        self.embedders = {}
+        self.cross_encoders = {}
+        self.retrievers = {}
+
+    def get_embedder(self, embedder_config, device):
+        key = (json.dumps(embedder_config, sort_keys=True), str(device))
+        if key not in self.embedders:
+            self.embedders[key] = init_embedder(embedder_config=embedder_config, device=device)
+        return self.embedders[key]
+
+    def get_reranker(self, retriever_config):
+        # The cross-encoder model is shared, each retriever keeps its own score cache
+        reranker_config = get_reranker_config(retriever_config)
+        if reranker_config is None:
+            return None
+        model_name = reranker_config['model_name']
+        if model_name not in self.cross_encoders:
+            self.cross_encoders[model_name] = load_cross_encoder(reranker_config)
+        return CrossEncoderReranker(self.cross_encoders[model_name], reranker_config)
+
+    def register(self, name, embedder_config, device, datasource, retriever_config):
+        assert name not in self.retrievers, f"Retriever {name} is already registered"
+        embedder = self.get_embedder(embedder_config, device)
+        reranker = self.get_reranker(retriever_config)
+        self.retrievers[name] = Retriever(name, embedder, embedder_config, datasource, retriever_config, reranker)
+        return self.retrievers[name]
+
+    def embedding_cache_stats(self):
+        return [embedder.stats() for embedder in self.embedders.values() if isinstance(embedder, CachedEmbeddings)]
+
+    def result_cache_stats(self):
+        return {name : retriever.result_cache.stats() for name, retriever in self.retrievers.items() if retriever.result_cache is not None}
+
+    def embedding_batching_stats(self):
+        stats = []
+        for embedder in self.embedders.values():
+            if isinstance(embedder, CachedEmbeddings):
+                embedder = embedder.embedder
+            if isinstance(embedder, BatchingEmbeddings):
+                stats.append(embedder.stats())
+        return stats
+
+    def get(self, name):
+        assert name in self.retrievers, f"Retriever {name} not registered. Available: {list(self.retrievers)}"
+        return self.retrievers[name]
+
+
+retriever_registry = RetrieverRegistry()
 
 def create_retriever_chain(embedder_config,
                             device,
                             datasource,
-                            retriever_config
+                            retriever_config,
+                            name="default"
                             ):
     print("Initializing Retrieval Chain")
-    global question_vector_store, answers_vector_store, similarity_top_k, similarity_threshold, corpus_data
-    # Intialize Embedder and VectorStore
-    embedder = init_embedder(embedder_config=embedder_config, device=device)
-    question_vector_store,  answers_vector_store = init_vectorstore(embedder)
-
-    corpus_data = load_data(datasource)
-    # Add Documents to VectorStore
-    question_documents = create_documents_from_df(corpus_data, index_questions=True)
-    question_vector_store.add_documents(documents=question_documents, ids=corpus_data.index.tolist())
-    print(f"{len(question_documents)} Documents added to Questions Vector Store")
-
-    answer_documents = create_documents_from_df(corpus_data, index_questions=False)
-    answers_vector_store.add_documents(documents=answer_documents, ids=corpus_data.index.tolist())
-    print(f"{len(answer_documents)} Documents added to Answers Vector Store")
-
-    similarity_top_k = retriever_config.get('similarity_top_k', 10)
-    similarity_threshold = retriever_config.get('similarity_threshold', 0.5)
-
-    ret_chain = retriever | format_retrieved_docs
+    retriever = retriever_registry.register(name, embedder_config, device, datasource, retriever_config)
+    ret_chain = retriever.as_chain()
     return ret_chain
 
 
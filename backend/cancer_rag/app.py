@@ -7,15 +7,17 @@ from pathlib import Path
 import os 
 from dotenv import load_dotenv
 
-from cancer_rag.ai.retriever import create_retriever_chain
+from cancer_rag.ai.retriever import create_retriever_chain, retriever_registry
 from cancer_rag.ai.chains import (
     create_conversion_chain, 
     create_knowledge_chain, 
     create_grader_chain,
-    create_eval_chains
+    create_eval_chains,
+    prompt_token_stats
 )
 from cancer_rag.models.database import create_db
 from cancer_rag.routers import session_chat_router, session_router
+from cancer_rag.utils import get_worker_memory
 # export PYTHONPATH=/path/to/cancer_rag_backend:$PYTHONPATH
 
 from cancer_rag.envs import envs
@@ -41,12 +43,31 @@ app = FastAPI(
 def healthcheck():
     return {"message" : "Welcome to NU Medicine Chatbot APIs"}
 
+@app.get('/worker_stats')
+def worker_stats():
+    # Per-worker memory, used to confirm mmap index sharing across uvicorn workers
+    return {
+        "index_load_mode" : config['retriever_config'].get('index_load_mode', 'memory'),
+        "embedding_cache" : retriever_registry.embedding_cache_stats(),
+        "embedding_batching" : retriever_registry.embedding_batching_stats(),
+        "result_cache" : retriever_registry.result_cache_stats(),
+        "prompt_tokens" : prompt_token_stats(),
+        **get_worker_memory()
+    }
+
 if INIT_MODE:
     create_db()
     print("Database Created")
 
 if not INIT_MODE:
     ret_chain = create_retriever_chain(config['embedder_config'], device, DATASOURCE, config['retriever_config'])
+    # Raw context retrieval, /context/batch embeds and searches a list of queries in one pass
+    add_routes(
+        app,
+        ret_chain,
+        path="/context",
+    )
+
     knowledge_chain = create_knowledge_chain(config['llm_config'], ret_chain)
     add_routes(
         app,
@@ -54,6 +75,26 @@ if not INIT_MODE:
         path="/retrieve",
     )
 
+    # Extra corpora get their own retriever over the shared embedder
+    for corpus_name, corpus_config in (config.get('corpora') or {}).items():
+        corpus_config = dict(corpus_config)
+        corpus_datasource = corpus_config.pop('datasource')
+        corpus_ret_chain = create_retriever_chain(
+            config['embedder_config'], device, corpus_datasource,
+            {**config['retriever_config'], **corpus_config},
+            name=corpus_name
+        )
+        add_routes(
+            app,
+            corpus_ret_chain,
+            path=f"/corpora/{corpus_name}/context",
+        )
+        add_routes(
+            app,
+            create_knowledge_chain(config['llm_config'], corpus_ret_chain),
+            path=f"/corpora/{corpus_name}/retrieve",
+        )
+
 
     conversational_chain = create_conversion_chain(config['llm_config'])
     add_routes(
@@ -1,3 +1,4 @@
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from cancer_rag.models.database import Session as SessionModel, SessionChat as SessionChatModel
 from cancer_rag.models.schema import SessionCreate, SessionChatCreate
@@ -25,3 +26,34 @@ def get_session_chats(db: Session, session_id: int):
 def get_verified_data(db: Session):
     return db.query(SessionChatModel).filter(SessionChatModel.is_verified == True).all()
 
+def iter_verified_data(db: Session, chunk_size: int):
+    """
+    Verified (id, parsed_question, response) rows in id order, chunk_size rows per list.
+    Only those columns are selected and rows are fetched from a server-side cursor as they are consumed
+    """
+    result = db.execute(
+        select(SessionChatModel.id, SessionChatModel.parsed_question, SessionChatModel.response)
+        .where(SessionChatModel.is_verified == True)
+        .order_by(SessionChatModel.id)
+        .execution_options(stream_results=True, yield_per=chunk_size)
+    )
+    yield from result.partitions()
+
+def get_verified_ids(db: Session):
+    return [row.id for row in db.query(SessionChatModel.id).filter(SessionChatModel.is_verified == True)]
+
+def get_verified_data_after(db: Session, last_id: int):
+    return (
+        db.query(SessionChatModel.id, SessionChatModel.parsed_question, SessionChatModel.response)
+        .filter(SessionChatModel.is_verified == True, SessionChatModel.id > last_id)
+        .order_by(SessionChatModel.id)
+        .all()
+    )
+
+def get_verified_data_by_ids(db: Session, ids):
+    return (
+        db.query(SessionChatModel.id, SessionChatModel.parsed_question, SessionChatModel.response)
+        .filter(SessionChatModel.is_verified == True, SessionChatModel.id.in_(ids))
+        .order_by(SessionChatModel.id)
+        .all()
+    )
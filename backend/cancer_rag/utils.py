@@ -3,12 +3,13 @@ import re
 import pandas as pd 
 from langchain.output_parsers import PydanticOutputParser
 from langchain.schema.runnable.passthrough import RunnableAssign
-from langchain_core.runnables import chain
+from langchain_core.runnables import Runnable
+from langchain_core.runnables.config import run_in_executor
 
-from cancer_rag.models.database import get_db
-from cancer_rag.crud import get_verified_data
 from langchain_core.documents import Document
 
+from cancer_rag.ai.corpus_store import is_arrow_column
+
 
 def RExtract(pydantic_class, llm, prompt):
     '''
@@ -30,31 +31,160 @@ def RExtract(pydantic_class, llm, prompt):
         return string
     return instruct_merge | prompt | llm | preparse | parser
 
+class VectorizedRunnable(Runnable):
+    '''
+    Runnable with a real batch implementation.
+    invoke calls func on one input, batch calls batch_func once on the whole list
+    instead of LangChain's default per-item thread loop.
+    '''
+    def __init__(self, func, batch_func, name=None):
+        self.func = func
+        self.batch_func = batch_func
+        self.name = name or func.__name__
+
+    def invoke(self, input, config=None, **kwargs):
+        return self._call_with_config(self.func, input, config)
+
+    def batch(self, inputs, config=None, *, return_exceptions=False, **kwargs):
+        if not inputs:
+            return []
+        return self._batch_with_config(self.batch_func, inputs, config, return_exceptions=return_exceptions)
+
+    async def abatch(self, inputs, config=None, *, return_exceptions=False, **kwargs):
+        return await run_in_executor(None, self.batch, inputs, config, return_exceptions=return_exceptions)
+
+
+PUNCTUATION = re.compile(r'[^\w\s]')
+# ASCII characters PUNCTUATION removes, deleted from ASCII text with one bytes.translate
+ASCII_PUNCTUATION = bytes(code for code in range(128) if PUNCTUATION.match(chr(code)))
+# PUNCTUATION verdict of every non-ASCII character seen so far
+UNICODE_PUNCTUATION = {}
+
+def is_punctuation(char):
+    if char not in UNICODE_PUNCTUATION:
+        UNICODE_PUNCTUATION[char] = PUNCTUATION.match(char) is not None
+    return UNICODE_PUNCTUATION[char]
+
 def preprocess_text(text):
     """
     Preprocess the input text for embedding by normalizing and cleaning.
+    Same result as removing [^\w\s] and collapsing \s+ with regexes, without scanning the text per character in Python.
     :param text: input string to preprocess
     :return: cleaned and preprocessed string
     """
-    print(text)
     text = text.lower()  # Convert to lowercase
-    text = re.sub(r'[^\w\s]', '', text)  # Remove punctuation
-    text = re.sub(r'\s+', ' ', text).strip()  # Remove extra whitespace
-    return text
+    # Remove punctuation
+    if text.isascii():
+        text = text.encode('ascii').translate(None, ASCII_PUNCTUATION).decode('ascii')
+    else:
+        for char in set(text):
+            if is_punctuation(char):
+                text = text.replace(char, '')
+    return " ".join(text.split())  # Remove extra whitespace
 
-def load_data_from_db():
+def preprocess_column(texts):
+    """preprocess_text over a whole column, Arrow backed columns stay Arrow backed so the corpus store can wrap them"""
+    values = [preprocess_text(text) for text in texts.astype(str)]
+    if is_arrow_column(texts):
+        import pyarrow as pa
+        return pd.Series(pd.arrays.ArrowExtensionArray(pa.array(values, type=pa.large_string())), index=texts.index)
+    return pd.Series(values, index=texts.index, dtype=object)
+
+def get_worker_memory():
+    """
+    Memory of the current worker process in MB. rss_file_mb counts mmapped pages shared with
+    other workers, pss_mb splits those shared pages evenly between the processes mapping them.
+    """
+    stats = {"pid" : os.getpid()}
+    fields = {"VmRSS" : "rss_mb", "RssAnon" : "rss_anon_mb", "RssFile" : "rss_file_mb", "Pss" : "pss_mb"}
+    for proc_file in ["/proc/self/status", "/proc/self/smaps_rollup"]:
+        if not os.path.exists(proc_file):
+            continue
+        with open(proc_file) as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in fields:
+                    stats[fields[key]] = round(int(value.split()[0]) / 1024, 2)
+    return stats
+
+# Verified chats fetched per round trip when loading a database corpus
+DB_CHUNK_ROWS = 10000
+
+def verified_frame(rows):
+    # Indexed by session_chat.id so the index sync can track which rows are already embedded
+    return pd.DataFrame(
+        {"Question" : [row.parsed_question for row in rows], "Answer" : [row.response for row in rows]},
+        index=pd.Index([row.id for row in rows], dtype="int64", name="id")
+    )
+
+def load_data_from_db(chunk_size=DB_CHUNK_ROWS):
+    """
+    Verified Q/A pairs, streamed chunk_size rows at a time with only the id and text columns selected.
+    No ORM objects or JSON columns are built, each chunk's values are appended to the column lists
+    and its rows released, and the frame is built once at the end
+    """
+    # The database engine is created on import, so csv only users (e.g. offline index builds) never need it
+    from cancer_rag.models.database import get_db
+    from cancer_rag.crud import iter_verified_data
+    ids, questions, answers = [], [], []
     db = next(get_db())
-    data = get_verified_data(db)
-    questions = []
-    answers = []
-    for row in data:
-        questions.append(row.parsed_question)
-        answers.append(row.response)
-    
-    data = pd.DataFrame({"Question" : questions, "Answer" : answers})
+    try:
+        for rows in iter_verified_data(db, chunk_size):
+            for row in rows:
+                ids.append(row.id)
+                questions.append(row.parsed_question)
+                answers.append(row.response)
+    finally:
+        db.close()
+    data = pd.DataFrame({"Question" : questions, "Answer" : answers}, index=pd.Index(ids, dtype="int64", name="id"))
     print(f"Loaded {data.shape[0]} Q/A Pairs")
     return data
 
+def load_verified_changes_from_db(last_id, indexed_ids, aliases=()):
+    """
+    Verified rows not in the index yet (new rows after last_id and rows verified late)
+    and the indexed ids that are no longer verified.
+    aliases are the (alias id, canonical id) pairs of collapsed duplicates. Verified aliases of a canonical
+    row that is no longer verified are returned with the new rows, to be indexed in its place.
+    """
+    from cancer_rag.models.database import get_db
+    from cancer_rag.crud import get_verified_ids, get_verified_data_after, get_verified_data_by_ids
+    db = next(get_db())
+    try:
+        verified_ids = set(get_verified_ids(db))
+        removed_ids = indexed_ids - verified_ids
+        late_ids = [_id for _id in verified_ids - indexed_ids if _id <= last_id]
+        late_ids += [alias_id for alias_id, canonical_id in aliases if canonical_id in removed_ids and alias_id in verified_ids]
+        rows = get_verified_data_after(db, last_id)
+        if late_ids:
+            rows = rows + get_verified_data_by_ids(db, late_ids)
+    finally:
+        db.close()
+
+    data = verified_frame(rows)
+    return data, removed_ids
+
+
+# Arrow IPC file extensions, written uncompressed by scripts/convert_corpus.py so they can be memory mapped
+ARROW_EXTENSIONS = ('.arrow', '.feather', '.ipc')
+
+def is_db_datasource(datasource):
+    return datasource.endswith('.db') or 'postgresql' in datasource
+
+def arrow_table_to_df(table):
+    """Text columns stay Arrow backed (no Python string per row until it is read), ids and labels become numpy columns"""
+    import pyarrow as pa
+    string_dtype = lambda arrow_type: pd.ArrowDtype(arrow_type) if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type) else None
+    return table.to_pandas(types_mapper=string_dtype)
+
+def load_arrow_data(datasource):
+    # pyarrow is only needed for parquet and Arrow corpora
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    if datasource.endswith('.parquet'):
+        return arrow_table_to_df(pq.read_table(datasource))
+    # The file is memory mapped and the text columns reference its pages
+    return arrow_table_to_df(pa.ipc.open_file(pa.memory_map(datasource)).read_all())
 
 def load_data(datasource):
     if datasource.endswith('.csv'):
@@ -64,39 +194,71 @@ def load_data(datasource):
         data = pd.read_csv(datasource)
         print(f"Loaded {data.shape[0]} Q/A Pairs")
         return data 
-    elif datasource.endswith('.db') or 'postgresql' in datasource:
+    elif datasource.endswith('.parquet'):
+        print("Loading data from parquet")
+        assert os.path.exists(datasource), f"DataSource {datasource} does not exist"
+        data = load_arrow_data(datasource)
+        print(f"Loaded {data.shape[0]} Q/A Pairs")
+        return data
+    elif datasource.endswith(ARROW_EXTENSIONS):
+        print("Loading data from Arrow IPC file")
+        assert os.path.exists(datasource), f"DataSource {datasource} does not exist"
+        data = load_arrow_data(datasource)
+        print(f"Loaded {data.shape[0]} Q/A Pairs")
+        return data
+    elif is_db_datasource(datasource):
         # SQLITE Data source
         print("Loading data from sql database")
         data = load_data_from_db()
         return data
     else:
-        raise NotImplementedError("Currently can load data from .csv, .db files and postgres urls")
-
-def create_documents_from_df(data, index_questions=True):
-    data['Question'] = data['Question'].apply(lambda x : preprocess_text(x))
-    data['Answer'] = data['Answer'].apply(lambda x : preprocess_text(x))
-    
-    if index_questions:
-        print("Indexing Questions")
-        documents = []
-        for index, row in data.iterrows():
-            question = row['Question']
-            #answer = row['Answer']
-            _ = Document(
-                page_content=question,
-                metadata={"id" : index}
-            )
-            documents.append(_)
-        return documents
-    else:
+        raise NotImplementedError("Currently can load data from .csv, .parquet, Arrow IPC (.arrow, .feather, .ipc), .db files and postgres urls")
+
+# Sentence ends, or line breaks between paragraphs and list items
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+|\n+')
+
+def split_sentences(text):
+    return [sentence.strip() for sentence in SENTENCE_BOUNDARY.split(text) if sentence.strip()]
+
+def sentence_windows(text, sentences=3, overlap=1):
+    """Windows of consecutive sentences sharing overlap sentences, the whole text if it fits in one window"""
+    parts = split_sentences(text)
+    if len(parts) <= sentences:
+        return [text]
+    windows = []
+    for start in range(0, len(parts), sentences - overlap):
+        windows.append(" ".join(parts[start:start + sentences]))
+        if start + sentences >= len(parts):
+            break
+    return windows
+
+def create_documents_from_df(data, passage_config=None):
+    """
+    Preprocesses the Question and Answer columns in place, in one pass, and returns the question and
+    answer Documents. The corpus store, BM25 and dedup read the preprocessed columns afterwards.
+    With a passage_config each answer becomes sentence window passages, cut on the raw punctuation
+    before the column is preprocessed.
+    """
+    passages = None
+    if passage_config is not None:
+        passages = [sentence_windows(str(answer), passage_config['sentences'], passage_config['overlap']) for answer in data['Answer']]
+    data['Question'] = preprocess_column(data['Question'])
+    data['Answer'] = preprocess_column(data['Answer'])
+    rows = list(zip(data.index, data['Question'], data['Answer']))
+
+    print("Indexing Questions")
+    question_documents = [Document(page_content=question, metadata={"id" : index}) for index, question, _ in rows]
+    if passages is None:
         print("Indexing Answers")
-        documents = []
-        for index, row in data.iterrows():
-            question = row['Question']
-            answer = row['Answer']
-            _ = Document(
-                page_content=answer,
-                metadata={"id" : index, "question" : question}
-            )
-            documents.append(_)
-        return documents
\ No newline at end of file
+        answer_documents = [
+            Document(page_content=answer, metadata={"id" : index, "question" : question})
+            for index, question, answer in rows
+        ]
+    else:
+        print("Indexing Answer Passages")
+        answer_documents = [
+            Document(page_content=preprocess_text(passage), metadata={"id" : index, "question" : question, "passage" : passage_number})
+            for (index, question, _), row_passages in zip(rows, passages)
+            for passage_number, passage in enumerate(row_passages)
+        ]
+    return question_documents, answer_documents
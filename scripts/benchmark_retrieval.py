@@ -0,0 +1,299 @@
+import gc
+import os
+import sys
+import json
+import math
+import time
+import platform
+import argparse
+import tempfile
+import contextlib
+from pathlib import Path
+from datetime import datetime, timezone
+
+import yaml
+import faiss
+import numpy as np
+
+from cancer_rag.utils import load_data, preprocess_text, get_worker_memory
+from cancer_rag.ai.retriever import Retriever, init_embedder
+from cancer_rag.ai.indexes import INDEX_TYPES, BUILD_PARAM_DEFAULTS, SEARCH_PARAM_DEFAULTS, build_index, prepare_vectors
+
+"""
+Benchmarks retrieval cost and quality on CPU, no LLM needed. For each embedder backend it reports
+corpus embedding throughput, query embedding latency and the end to end latency of the configured
+retriever chain on the real corpus. The corpus question vectors are then scaled up with synthetic
+entries (paraphrase: noisy copies of corpus vectors, random: random vectors of the same norm) and
+every index type is built over them, reporting build time, memory, search latency p50/p95/p99 and
+recall@k against an exact IndexFlatL2 search of the same vectors. Results are written as JSON so
+runs can be compared over time.
+
+Example:
+
+python scripts/benchmark_retrieval.py \
+    --config backend/cancer_rag/configs/config.yaml \
+    --datasource data/data_files/capstone_final_data_v1.csv \
+    --scales 100000 1000000 \
+    --output benchmark_results/retrieval.json
+
+With the ONNX backend next to the configured one (scripts/export_onnx_embedder.py output)
+python scripts/benchmark_retrieval.py \
+    --embedders config onnx onnx_int8 \
+    --onnx-dir backend/onnx_models/all-mpnet-base-v2
+"""
+
+EMBEDDERS = ["config", "onnx", "onnx_int8"]
+SYNTHETIC_MODES = ["paraphrase", "random"]
+# Synthetic vectors are generated this many rows at a time to bound the temporary memory
+SYNTHETIC_CHUNK_ROWS = 65536
+
+
+def get_embedder_config(config, name, onnx_dir):
+    # Cache and micro-batching would hide the model cost, every backend is measured bare
+    if name == "config":
+        return {**config['embedder_config'], "cache" : None, "batching" : None}
+    assert onnx_dir, f"--onnx-dir is required for the {name} embedder"
+    params = config['embedder_config']['params']
+    return {
+        "backend" : "ONNX",
+        "params" : {**params, "onnx_dir" : onnx_dir, "quantize" : name == "onnx_int8"},
+    }
+
+
+def latency_summary(seconds):
+    milliseconds = np.asarray(seconds) * 1000
+    return {
+        "p50_ms" : round(float(np.percentile(milliseconds, 50)), 3),
+        "p95_ms" : round(float(np.percentile(milliseconds, 95)), 3),
+        "p99_ms" : round(float(np.percentile(milliseconds, 99)), 3),
+        "mean_ms" : round(float(milliseconds.mean()), 3),
+    }
+
+
+def timed_calls(func, inputs):
+    latencies = []
+    for item in inputs:
+        start = time.perf_counter()
+        func(item)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def rss_mb():
+    gc.collect()
+    return get_worker_memory().get('rss_mb', 0.0)
+
+
+@contextlib.contextmanager
+def quiet():
+    # The retriever logs every query, which would dominate the measured latency
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def index_size_mb(index):
+    # Serialized size, what a loaded or mmapped index holds. Written to disk so large indexes are not copied in memory
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "index.faiss")
+        faiss.write_index(index, path)
+        return round(os.path.getsize(path) / 2**20, 2)
+
+
+def synthesize_vectors(base_vectors, size, mode, noise, rng):
+    """
+    base_vectors followed by synthetic rows up to size. paraphrase rows are random corpus vectors plus
+    gaussian noise of noise * their norm (cosine about 1 / sqrt(1 + noise^2) to the source row),
+    random rows are gaussian vectors with the mean corpus norm
+    """
+    num_base, dimension = base_vectors.shape
+    if size <= num_base:
+        return np.ascontiguousarray(base_vectors[:size])
+    vectors = np.empty((size, dimension), dtype=np.float32)
+    vectors[:num_base] = base_vectors
+    norms = np.linalg.norm(base_vectors, axis=1).astype(np.float32)
+    for start in range(num_base, size, SYNTHETIC_CHUNK_ROWS):
+        count = min(SYNTHETIC_CHUNK_ROWS, size - start)
+        if mode == "paraphrase":
+            sources = rng.integers(0, num_base, count)
+            chunk = base_vectors[sources] + rng.standard_normal((count, dimension), dtype=np.float32) * (noise * norms[sources, None] / math.sqrt(dimension))
+            target_norms = norms[sources]
+        else:
+            chunk = rng.standard_normal((count, dimension), dtype=np.float32)
+            target_norms = np.full(count, norms.mean(), dtype=np.float32)
+        chunk *= (target_norms / np.maximum(np.linalg.norm(chunk, axis=1), 1e-12))[:, None]
+        vectors[start:start + count] = chunk
+    return vectors
+
+
+def recall_at_k(found, expected):
+    # Fraction of the exact top k found by the approximate index, averaged over queries
+    k = expected.shape[1]
+    return float(np.mean([len(set(f[f >= 0]) & set(e)) / k for f, e in zip(found, expected)]))
+
+
+def benchmark_embedder(embedder, questions, queries, batch_size):
+    start = time.perf_counter()
+    vectors = []
+    for batch_start in range(0, len(questions), batch_size):
+        vectors.extend(embedder.embed_documents(questions[batch_start:batch_start + batch_size]))
+    embed_seconds = time.perf_counter() - start
+    vectors = np.array(vectors, dtype=np.float32)
+    query_vectors = np.array([embedder.embed_query(query) for query in queries], dtype=np.float32)
+    report = {
+        "dimension" : int(vectors.shape[1]),
+        "corpus_embed_s" : round(embed_seconds, 3),
+        "corpus_texts_per_s" : round(len(questions) / embed_seconds, 1),
+        "query_embed" : latency_summary(timed_calls(embedder.embed_query, queries)),
+    }
+    return report, vectors, query_vectors
+
+
+def benchmark_pipeline(name, embedder, embedder_config, datasource, retriever_config, queries):
+    """Build the configured retriever on the real corpus and time its chain one query at a time"""
+    retriever_config = {
+        **retriever_config,
+        "index_cache_dir" : None, "bundle_path" : None, "index_load_mode" : "memory",
+        "sync_interval_seconds" : 0, "result_cache" : None,
+    }
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    with quiet():
+        retriever = Retriever(f"benchmark_{name}", embedder, embedder_config, datasource, retriever_config)
+    build_seconds = time.perf_counter() - start
+    chain = retriever.as_chain()
+    with quiet():
+        chain.invoke({"query" : queries[0]})
+        latencies = timed_calls(lambda query: chain.invoke({"query" : query}), queries)
+        batch_start = time.perf_counter()
+        chain.batch([{"query" : query} for query in queries])
+        batch_seconds = time.perf_counter() - batch_start
+    return {
+        "build_s" : round(build_seconds, 3),
+        "rss_delta_mb" : round(rss_mb() - rss_before, 1),
+        "rows" : int(retriever.active_mask.sum()),
+        "query" : latency_summary(latencies),
+        "batch_qps" : round(len(queries) / batch_seconds, 1),
+    }
+
+
+def benchmark_index(vectors, query_vectors, expected, index_config, k):
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    with quiet():
+        index = build_index(vectors, index_config)
+        index.add(vectors)
+    build_seconds = time.perf_counter() - start
+    memory = rss_mb() - rss_before
+
+    index.search(query_vectors[:1], k)
+    latencies = timed_calls(lambda row: index.search(query_vectors[row:row + 1], k), range(len(query_vectors)))
+    batch_start = time.perf_counter()
+    _, found = index.search(query_vectors, k)
+    batch_seconds = time.perf_counter() - batch_start
+    report = {
+        "build_s" : round(build_seconds, 3),
+        "index_mb" : index_size_mb(index),
+        "rss_delta_mb" : round(memory, 1),
+        "search" : latency_summary(latencies),
+        "batch_qps" : round(len(query_vectors) / batch_seconds, 1),
+        f"recall_at_{k}" : round(recall_at_k(found, expected), 4),
+    }
+    del index
+    return report
+
+
+def get_index_config(base_config, index_type):
+    # Configured metric and storage, plus the configured tunables when the type matches
+    index_config = {
+        "type" : index_type,
+        "metric" : base_config.get('metric', 'l2'),
+        "storage" : "float32" if index_type == "ivf_pq" else base_config.get('storage', 'float32'),
+    }
+    if base_config.get('type', 'flat') == index_type:
+        tunables = [*BUILD_PARAM_DEFAULTS[index_type], *SEARCH_PARAM_DEFAULTS[index_type]]
+        index_config.update({key : base_config[key] for key in tunables if key in base_config})
+    return index_config
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=Path, default=Path("backend/cancer_rag/configs/config.yaml"), help="Backend config.yaml")
+    parser.add_argument("--datasource", type=str, default="data/data_files/capstone_final_data_v1.csv", help="CSV path or database URI of the real corpus")
+    parser.add_argument("--embedders", nargs="+", default=["config"], choices=EMBEDDERS, help="config is the configured embedder_config")
+    parser.add_argument("--onnx-dir", type=str, default=None, help="ONNX export for the onnx and onnx_int8 embedders")
+    parser.add_argument("--index-types", nargs="+", default=INDEX_TYPES, choices=INDEX_TYPES, help="Index types built at every scale")
+    parser.add_argument("--scales", nargs="+", type=int, default=[100000, 1000000], help="Synthetic corpus sizes, the real corpus size is always included")
+    parser.add_argument("--synthetic", type=str, default="paraphrase", choices=SYNTHETIC_MODES, help="How synthetic entries are generated")
+    parser.add_argument("--noise", type=float, default=0.3, help="Relative noise of paraphrase entries")
+    parser.add_argument("--num-queries", type=int, default=200, help="Corpus questions used as queries")
+    parser.add_argument("--k", type=int, default=10, help="Neighbours searched and compared for recall@k")
+    parser.add_argument("--batch-size", type=int, default=64, help="Texts per embed_documents call when embedding the corpus")
+    parser.add_argument("--skip-pipeline", action="store_true", help="Skip the end to end retriever chain runs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, default=None, help="JSON results file, benchmark_results/retrieval_<utc time>.json if unset")
+
+    args = parser.parse_args()
+    config = yaml.full_load(open(args.config))
+    retriever_config = config['retriever_config']
+    base_index_config = retriever_config.get('index', {})
+    rng = np.random.default_rng(args.seed)
+    created_at = datetime.now(timezone.utc)
+
+    corpus_data = load_data(args.datasource)
+    with quiet():
+        questions = [preprocess_text(str(text)) for text in corpus_data['Question']]
+    query_rows = rng.choice(len(questions), size=min(args.num_queries, len(questions)), replace=False)
+    # Raw questions, the retriever chain preprocesses them itself
+    queries = [str(corpus_data['Question'].iloc[row]) for row in query_rows]
+    scales = sorted({len(questions), *args.scales})
+
+    results = {
+        "created_at" : created_at.isoformat(),
+        "host" : {"platform" : platform.platform(), "python" : sys.version.split()[0], "cpu_count" : os.cpu_count(), "faiss" : faiss.__version__},
+        "params" : {
+            "datasource" : os.path.basename(args.datasource), "corpus_rows" : len(questions), "num_queries" : len(queries),
+            "k" : args.k, "synthetic" : args.synthetic, "noise" : args.noise, "seed" : args.seed,
+            "metric" : base_index_config.get('metric', 'l2'), "storage" : base_index_config.get('storage', 'float32'),
+        },
+        "embedders" : [],
+        "indexes" : [],
+    }
+
+    for embedder_name in args.embedders:
+        embedder_config = get_embedder_config(config, embedder_name, args.onnx_dir)
+        with quiet():
+            embedder = init_embedder(embedder_config, 'cpu')
+        with quiet():
+            query_texts = [preprocess_text(query) for query in queries]
+        embedder_report, corpus_vectors, query_vectors = benchmark_embedder(embedder, questions, query_texts, args.batch_size)
+        if not args.skip_pipeline:
+            embedder_report['pipeline'] = benchmark_pipeline(embedder_name, embedder, embedder_config, args.datasource, retriever_config, queries)
+        results['embedders'].append({"embedder" : embedder_name, "backend" : embedder_config['backend'], **embedder_report})
+        print(f"[{embedder_name}] {json.dumps(embedder_report)}")
+
+        prepare_vectors(corpus_vectors, base_index_config)
+        prepare_vectors(query_vectors, base_index_config)
+        for scale in scales:
+            vectors = synthesize_vectors(corpus_vectors, scale, args.synthetic, args.noise, rng)
+            # Exact neighbours of the same (prepared) vectors, L2 order is cosine order for unit vectors
+            exact_index = faiss.IndexFlatL2(vectors.shape[1])
+            exact_index.add(vectors)
+            _, expected = exact_index.search(query_vectors, args.k)
+            del exact_index
+            for index_type in args.index_types:
+                index_config = get_index_config(base_index_config, index_type)
+                report = benchmark_index(vectors, query_vectors, expected, index_config, args.k)
+                row = {"embedder" : embedder_name, "scale" : scale, "synthetic_rows" : max(0, scale - len(questions)), "index" : index_config, **report}
+                results['indexes'].append(row)
+                print(
+                    f"[{embedder_name}] {scale:>8} rows {index_type:<8} build {report['build_s']:>8.2f}s  index {report['index_mb']:>9.2f}MB  "
+                    f"p50 {report['search']['p50_ms']:.3f}ms  p99 {report['search']['p99_ms']:.3f}ms  recall@{args.k} {report[f'recall_at_{args.k}']:.4f}"
+                )
+            del vectors
+            gc.collect()
+
+    output = args.output or Path("benchmark_results") / f"retrieval_{created_at.strftime('%Y%m%dT%H%M%SZ')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
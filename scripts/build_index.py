@@ -0,0 +1,84 @@
+import os
+import json
+import shutil
+import argparse
+from pathlib import Path
+
+import yaml
+import torch
+
+from cancer_rag.utils import load_data, is_db_datasource
+from cancer_rag.ai.retriever import init_embedder, build_artifact
+from cancer_rag.ai.index_store import compute_index_hash, read_manifest, save_index_artifact, verify_bundle
+
+"""
+Builds the retrieval indexes of a corpus offline into a self-describing bundle (FAISS indexes, ids,
+corpus text, BM25 index, manifest with the embedder/index config and sha256 of every file). Point
+retriever_config.bundle_path (or a corpora entry's bundle_path) at the output so the backend only
+loads it at startup.
+
+Example:
+
+python scripts/build_index.py \
+    --config backend/cancer_rag/configs/config.yaml \
+    --datasource data/data_files/capstone_final_data_v1.csv \
+    --output-dir backend/index_bundles/default
+
+For an extra corpus, with its retriever_config overrides from the corpora section
+python scripts/build_index.py \
+    --config backend/cancer_rag/configs/config.yaml \
+    --corpus radiology_faq \
+    --output-dir backend/index_bundles/radiology_faq
+"""
+
+def get_corpus_config(config, corpus_name):
+    retriever_config = dict(config['retriever_config'])
+    if corpus_name is None:
+        return retriever_config, None
+    corpus_config = dict(config['corpora'][corpus_name])
+    datasource = corpus_config.pop('datasource', None)
+    return {**retriever_config, **corpus_config}, datasource
+
+
+def describe_datasource(datasource):
+    # Database URIs can carry credentials, the manifest only records the kind of source
+    return "database" if is_db_datasource(datasource) else os.path.basename(datasource)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=Path, default=Path("backend/cancer_rag/configs/config.yaml"), help="Backend config.yaml")
+    parser.add_argument("--datasource", type=str, default=None, help="CSV path or database URI, defaults to the corpus datasource")
+    parser.add_argument("--corpus", type=str, default=None, help="Entry of the corpora section to build, default corpus if unset")
+    parser.add_argument("--output-dir", type=Path, required=True, help="Bundle directory to write")
+    parser.add_argument("--device", type=str, default=None, help="Embedding device, cuda when available if unset")
+    parser.add_argument("--overwrite", action="store_true", help="Replace an existing bundle that is out of date or fails verification")
+
+    args = parser.parse_args()
+    config = yaml.full_load(open(args.config))
+    retriever_config, corpus_datasource = get_corpus_config(config, args.corpus)
+    datasource = args.datasource or corpus_datasource
+    assert datasource, "--datasource is required for the default corpus"
+    embedder_config = config['embedder_config']
+    index_config = retriever_config.get('index', {})
+    device = torch.device(args.device or ('cuda' if torch.cuda.is_available() else 'cpu'))
+
+    corpus_data = load_data(datasource)
+    index_hash = compute_index_hash(corpus_data, embedder_config, index_config)
+    output_dir = str(args.output_dir)
+
+    manifest = read_manifest(output_dir)
+    if manifest is not None and manifest['index_hash'] == index_hash and not verify_bundle(output_dir):
+        print(f"Bundle at {output_dir} is up to date ({index_hash[:12]})")
+        raise SystemExit(0)
+    if os.path.exists(output_dir):
+        assert args.overwrite, f"{output_dir} already holds a different or damaged bundle, pass --overwrite to replace it"
+        shutil.rmtree(output_dir)
+
+    embedder = init_embedder({**embedder_config, "cache" : None}, device)
+    artifact = build_artifact(corpus_data, embedder, index_config)
+    save_index_artifact(output_dir, index_hash, artifact, embedder_config, index_config, source=describe_datasource(datasource))
+
+    manifest = read_manifest(output_dir)
+    print(json.dumps({key : manifest[key] for key in ["index_hash", "created_at", "source", "build_params"]}, indent=2))
+    print(f"{len(manifest['files'])} files checksummed, bundle ready at {output_dir}")
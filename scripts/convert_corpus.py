@@ -0,0 +1,83 @@
+import os
+import time
+import argparse
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from cancer_rag.utils import load_data, ARROW_EXTENSIONS
+
+"""
+Converts a Q/A corpus (CSV, or a database URI) to parquet or an Arrow IPC file, chosen by the output
+extension, so startup reads Arrow buffers instead of parsing CSV. Arrow IPC files are written
+uncompressed so the backend can memory map them and use their text buffers without copying; parquet
+is smaller on disk but has to be decoded. Text columns are stored as large_string so a column can hold
+more than 2GB. The output is read back and compared with the input before the command returns.
+
+Example:
+
+python scripts/convert_corpus.py \
+    --input data/data_files/capstone_final_data_v1.csv \
+    --output data/data_files/capstone_final_data_v1.arrow
+"""
+
+PARQUET_COMPRESSIONS = ["zstd", "snappy", "none"]
+
+
+def to_arrow_table(data):
+    # RangeIndex is kept as metadata only, any other index (session_chat ids) becomes a column restored on load
+    table = pa.Table.from_pandas(data)
+    schema = pa.schema([
+        field.with_type(pa.large_string()) if pa.types.is_string(field.type) else field
+        for field in table.schema
+    ], metadata=table.schema.metadata)
+    return table.cast(schema)
+
+
+def same_column(left, right):
+    # Nulls match whatever their pandas form (NaN from CSV, NA from Arrow)
+    left_null, right_null = left.isna().to_numpy(), right.isna().to_numpy()
+    if not (left_null == right_null).all():
+        return False
+    return bool((left[~left_null].astype(object).to_numpy() == right[~right_null].astype(object).to_numpy()).all())
+
+
+def write_corpus(table, output, compression):
+    if output.endswith('.parquet'):
+        pq.write_table(table, output, compression=None if compression == "none" else compression)
+    else:
+        # One record batch, so every column is a single contiguous buffer when mapped
+        with pa.OSFile(output, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=max(table.num_rows, 1))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", type=str, required=True, help="CSV path or database URI to convert")
+    parser.add_argument("--output", type=Path, required=True, help=f"Output file, .parquet or Arrow IPC {ARROW_EXTENSIONS}")
+    parser.add_argument("--compression", type=str, default="zstd", choices=PARQUET_COMPRESSIONS, help="Parquet codec, Arrow IPC output is never compressed")
+    parser.add_argument("--overwrite", action="store_true", help="Replace an existing output file")
+
+    args = parser.parse_args()
+    output = str(args.output)
+    assert output.endswith(('.parquet', *ARROW_EXTENSIONS)), f"--output must end with .parquet or one of {ARROW_EXTENSIONS}"
+    assert args.overwrite or not os.path.exists(output), f"{output} exists, pass --overwrite to replace it"
+
+    start = time.perf_counter()
+    data = load_data(args.input)
+    input_seconds = time.perf_counter() - start
+    assert {'Question', 'Answer'} <= set(data.columns), "The corpus needs Question and Answer columns"
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    write_corpus(to_arrow_table(data), output, args.compression)
+
+    start = time.perf_counter()
+    converted = load_data(output)
+    output_seconds = time.perf_counter() - start
+    for column in data.columns:
+        assert same_column(data[column], converted[column]), f"Column {column} differs after conversion"
+    assert data.index.equals(converted.index), "Row index differs after conversion"
+
+    print(f"Wrote {len(converted)} rows to {output} ({os.path.getsize(output) / 2**20:.2f}MB)")
+    print(f"Load time: input {input_seconds:.3f}s, converted {output_seconds:.3f}s")
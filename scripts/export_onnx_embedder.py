@@ -0,0 +1,68 @@
+import json
+import time
+import argparse
+from pathlib import Path
+
+import yaml
+from langchain_huggingface import HuggingFaceEmbeddings
+
+from cancer_rag.utils import load_data, preprocess_text
+from cancer_rag.ai.embedder import OnnxEmbeddings, export_onnx_embedder, embedding_parity
+
+"""
+Exports the configured sentence-transformers embedder to ONNX (fp32 and dynamic int8) for the ONNX
+embedder backend, then checks on the corpus that the ONNX vectors match the HF ones and retrieve the
+same answers for each question.
+
+Example:
+
+python scripts/export_onnx_embedder.py \
+    --config backend/cancer_rag/configs/config.yaml \
+    --output-dir backend/onnx_models/all-mpnet-base-v2 \
+    --parity-data data/data_files/capstone_final_data_v1.csv \
+    --num-threads 4
+"""
+
+def query_latency_ms(embedder, texts):
+    # One query at a time, the way the retriever embeds single requests
+    start = time.perf_counter()
+    for text in texts:
+        embedder.embed_query(text)
+    return round((time.perf_counter() - start) * 1000 / max(len(texts), 1), 2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=Path, default=Path("backend/cancer_rag/configs/config.yaml"), help="Backend config.yaml")
+    parser.add_argument("--output-dir", type=Path, required=True, help="Directory for the ONNX models and tokenizer")
+    parser.add_argument("--no-quantize", action="store_true", help="Skip the int8 model")
+    parser.add_argument("--parity-data", type=str, default=None, help="CSV path or database URI to compare HF and ONNX embeddings on")
+    parser.add_argument("--num-threads", type=int, default=None, help="ONNX Runtime intra-op threads for the parity run")
+    parser.add_argument("--k", type=int, default=3, help="Top k answers compared per question")
+
+    args = parser.parse_args()
+    config = yaml.full_load(open(args.config))
+    embedder_params = config['embedder_config']['params']
+    model_name = embedder_params['model_name']
+    quantize = not args.no_quantize
+
+    export_onnx_embedder(model_name, str(args.output_dir), quantize=quantize)
+
+    if args.parity_data:
+        corpus_data = load_data(args.parity_data)
+        questions = [preprocess_text(text) for text in corpus_data['Question']]
+        answers = [preprocess_text(text) for text in corpus_data['Answer']]
+        encode_kwargs = embedder_params.get('encode_kwargs', {})
+        reference = HuggingFaceEmbeddings(model_name=model_name, model_kwargs={'device': 'cpu'}, encode_kwargs=encode_kwargs)
+
+        report = {"model_name" : model_name, "hf_query_ms" : query_latency_ms(reference, questions[:50])}
+        for precision in ["fp32", "int8"] if quantize else ["fp32"]:
+            candidate = OnnxEmbeddings(
+                str(args.output_dir), quantize=precision == "int8", num_threads=args.num_threads,
+                normalize_embeddings=encode_kwargs.get('normalize_embeddings', False)
+            )
+            report[precision] = {
+                **embedding_parity(reference, candidate, questions, answers, k=args.k),
+                "query_ms" : query_latency_ms(candidate, questions[:50]),
+            }
+        print(json.dumps(report, indent=2))